@@ -4,11 +4,33 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm
 from django.utils import timezone
-from .models import Assignment, Performance, Award, UserAward
+from .models import Assignment, Performance, Award, UserAward, Job
+from .awards import get_award_catalog, invalidate_award_catalog
+from .cache import bump_leaderboard_version
+from .events import AwardRevoked, publish
+from .leaderboard import close_ended_assignments
 
 User = get_user_model()
 
 
+class InvalidatesCacheMixin:
+    """
+    Changes made in the admin panel can change what the dashboard and scoreboard show,
+    so cached pages are invalidated (see cache.py)
+    """
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_leaderboard_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_leaderboard_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_leaderboard_version()
+
+
 # cutsom admin forms if needed
 class CustomUserChangeForm(UserChangeForm):
     class Meta:
@@ -23,7 +45,7 @@ class CustomUserCreationForm(UserCreationForm):
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(InvalidatesCacheMixin, BaseUserAdmin):
     form = CustomUserChangeForm
     add_form = CustomUserCreationForm
 
@@ -61,7 +83,7 @@ class UserAdmin(BaseUserAdmin):
         - Choose action "Give Demonstration Dodo badge to selected users"
         """
         try:
-            demonstration_dodo = Award.objects.get(name='Demonstration Dodo')
+            demonstration_dodo = get_award_catalog()['Demonstration Dodo']
 
             count = 0
 
@@ -77,22 +99,28 @@ class UserAdmin(BaseUserAdmin):
                     count += 1
 
             if count > 0:
+                bump_leaderboard_version()
                 messages.success(request, f'Aawrded the Demonstration Dodo badge to {count} user(s).')
             else:
                 messages.info(request, 'All selected users already have the Demonstration Dodo badge.')
 
-        except Award.DoesNotExist:
+        except KeyError:
             messages.error(request, 'Run initialize_awards() first.')
 
     give_demonstration_dodo_badge.short_description = "Give Demonstration Dodo badge to selected users"
 
 
 @admin.register(Assignment)
-class AssignmentAdmin(admin.ModelAdmin):
+class AssignmentAdmin(InvalidatesCacheMixin, admin.ModelAdmin):
     list_display = ('name', 'end_date')
     search_fields = ('name', 'description')
     list_filter = ('end_date',)
 
+    # moving the end date can close a week or reopen a closed one
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        close_ended_assignments()
+
 
 @admin.register(Performance)
 class PerformanceAdmin(admin.ModelAdmin):
@@ -106,14 +134,27 @@ class PerformanceAdmin(admin.ModelAdmin):
 
 
 @admin.register(Award)
-class AwardAdmin(admin.ModelAdmin):
+class AwardAdmin(InvalidatesCacheMixin, admin.ModelAdmin):
     list_display = ('name', 'description', 'image_name')
     search_fields = ('name', 'description')
     ordering = ('name',)
 
+    # the awards are cached by name in every process (see get_award_catalog), so they are reloaded after every change
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_award_catalog()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_award_catalog()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        invalidate_award_catalog()
+
 
 @admin.register(UserAward)
-class UserAwardAdmin(admin.ModelAdmin):
+class UserAwardAdmin(InvalidatesCacheMixin, admin.ModelAdmin):
     list_display = ('user', 'award', 'earned_date')
     list_filter = ('award', 'earned_date')
     search_fields = ('user__username', 'award__name')
@@ -122,3 +163,24 @@ class UserAwardAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('user', 'award')
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        publish(AwardRevoked(obj.user_id, obj.award.name))
+
+    def delete_queryset(self, request, queryset):
+        revoked = list(queryset.values_list('user_id', 'award__name'))
+        super().delete_queryset(request, queryset)
+        for user_id, award_name in revoked:
+            publish(AwardRevoked(user_id, award_name))
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'user', 'status', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('user__username',)
+    ordering = ('-created_at',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
@@ -0,0 +1,17 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def seed_awards(sender, **kwargs):
+    from .awards import initialize_awards
+    initialize_awards()
+
+
+class MigaConfig(AppConfig):
+    name = 'miga'
+
+    def ready(self):
+        # make sure all awards exist, instead of checking on every request
+        post_migrate.connect(seed_awards, sender=self)
+        # the award rules subscribe to events, this makes sure they are registered before anything is published
+        from . import awards
@@ -1,402 +1,456 @@
+import threading
 from datetime import  time
+from functools import cached_property
+
 from django.utils import timezone
-from .models import Award, UserAward, User, Performance, BenchmarkMetric, Assignment
+from .models import Award, UserAward, Performance, BenchmarkMetric, User
+from .cache import bump_award_catalog_version, bump_leaderboard_version, get_award_catalog_version
+from .events import (AssignmentClosed, AssignmentCompleted, AwardRevoked, RankChanged, SubmissionIngested,
+                     subscribe)
 
-# Award definitions
-AWARDS = [
-    {
-        'name': 'Early Bird',
-        'description': 'Push an assignment between 5:00 and 9:00'
-    },
-    {
-        'name': 'Steady Sailor',
-        'description': 'Stay in the same place for 3 consecutive weeks'
-    },
-    {
-        'name': 'Tortoise Triumph',
-        'description': 'Climb to a higher rank 3 weeks in a row'
-    },
-    {
-        'name': 'Database Devil',
-        'description': 'Implement your own main memory database'
-    },
-    {
-        'name': 'Night Owl',
-        'description': 'Push a completed assignment between 23:00 and 5:00'
-    },
-    {
-        'name': 'Weekend Warrior',
-        'description': 'Push a completed assignment on a Saturday or Sunday'
-    },
-    {
-        'name': 'Halfway Hero',
-        'description': 'Complete 50% of all assignment'
-    },
-    {
-        'name': 'Winning Whale',
-        'description': 'Reach first place'
-    },
-    {
-        'name': 'Momentum Monkey',
-        'description': 'Stay in the top 5 for 3 consecutive weeks'
-    },
-    {
-        'name': 'Comeback Kid',
-        'description': 'Jump 5 ranks in 1 week'
-    },
-    {
-        'name': 'High Score Horse',
-        'description': 'Be in first place for an assignment'
-    },
-    {
-        'name': 'Demonstration Dodo',
-        'description': 'Present your work in class'
-    },
-    {
-        'name': 'Punctual Peacock',
-        'description': 'Hand in every assignment before the deadline'
-    },
-    {
-        'name': 'Timely Toucan',
-        'description': 'Hand in an assignment the day it is due'
-    },
-    {
-        'name': 'Excellent Elephant',
-        'description': 'Be in the top 3'
-    }
-]
 
-def initialize_awards():
+class AwardRule:
     """
-    Initialize awards in the database.
-    If theres an issue with any awards/if new awards were added & it doens't work as expected, this is often the solution
+    Base class for all awards.
+    A rule declares the data it needs in `requires`. The evaluator loads that data once per user (see AwardData),
+    and a rule is only evaluated if everything it requires is available, e.g. time based awards need a submission.
+    A rule is only evaluated when one of the events in `events` is published (see events.py), these are the events
+    that can change whether the award is earned.
     """
-    for award_data in AWARDS:
-        Award.objects.get_or_create(
-            name=award_data['name'],
-            defaults={'description': award_data['description']}
-        )
+    name = None
+    description = None
+    requires = ()
+    # manual awards are given out by an admin, never by the evaluator
+    manual = False
+    events = ()
+    # only depends on submission times, performances, end dates and the leaders of past submissions,
+    # so it can be evaluated again for past submissions (see replay_awards and `manage.py rebuild_derived`)
+    replayable = False
 
-def check_time_based_award(user, submission_time, start_hour, end_hour, award_name):
-    submission_time = submission_time.time()
-    start = time(start_hour, 0)
-    end = time(end_hour, 0)
+    def is_earned(self, data):
+        raise NotImplementedError
 
-    if start <= submission_time <= end:
-        award = Award.objects.get(name=award_name)
-        UserAward.objects.get_or_create(user=user, award=award)
-        return True
-    return False
 
-def check_weekend_warrior(user, submission_time):
+class TimeOfDayRule(AwardRule):
     """
-    checks if the user has anu assignment submitted on a sat/sun
+    Awards for pushing between start_hour and end_hour. The range may go past midnight
     """
-    if submission_time.tzinfo is None:
-        submission_time = timezone.make_aware(submission_time)
+    requires = ('submission_time',)
+    events = (SubmissionIngested,)
+    replayable = True
+    start_hour = 0
+    end_hour = 0
 
-    weekday = submission_time.weekday()
+    def is_earned(self, data):
+        submission_time = data.submission_time.time()
+        start = time(self.start_hour, 0)
+        end = time(self.end_hour, 0)
 
-    performances = Performance.objects.filter(user=user)
-    for perf in performances:
-        perf_time = perf.submission_time
-        if perf_time.tzinfo is None:
-            perf_time = timezone.make_aware(perf_time)
+        if start <= end:
+            return start <= submission_time <= end
+        return submission_time >= start or submission_time <= end
 
-        perf_weekday = perf_time.weekday()
 
-        # past submission
-        if check_weekday(user, perf_weekday): return True
+class EarlyBird(TimeOfDayRule):
+    name = 'Early Bird'
+    description = 'Push an assignment between 5:00 and 9:00'
+    start_hour = 5
+    end_hour = 9
 
-    # curr submission
-    if check_weekday(user, weekday): return True
 
-    return False
+class SteadySailor(AwardRule):
+    name = 'Steady Sailor'
+    description = 'Stay in the same place for 3 consecutive weeks'
+    requires = ('rank_history',)
+    events = (RankChanged,)
 
-def check_weekday(user, day):
-    if day >= 5:  # 5 is Saturday, 6 is Sunday
-        award = Award.objects.get(name='Weekend Warrior')
-        UserAward.objects.get_or_create(user=user, award=award)
-        return True
+    def is_earned(self, data):
+        # all values in a sequence are the same
+        return any(len(set(sequence)) == 1 for sequence in find_sequence(3, data.rank_history))
+
+
+class TortoiseTriumph(AwardRule):
+    name = 'Tortoise Triumph'
+    description = 'Climb to a higher rank 3 weeks in a row'
+    requires = ('rank_history',)
+    events = (RankChanged,)
+
+    def is_earned(self, data):
+        for sequence in find_sequence(4, data.rank_history):
+            if all(sequence[i] < sequence[i + 1] for i in range(len(sequence) - 1)):
+                return True
+        return False
 
 
-def check_high_score_horse(user, current_rank=None):
+class DatabaseDevil(AwardRule):
     """
-    Check if user is in first place for any assignment
+    User has benchmarks for 6 weeks.
+    This implies that the tests for all 6 wekks passed, since the bm stage wouldnt otherwise be reached -> user implemented db
     """
+    name = 'Database Devil'
+    description = 'Implement your own main memory database'
+    requires = ('metric_weeks',)
+    events = (SubmissionIngested,)
 
-    if current_rank == 1:
-        award = Award.objects.get(name='High Score Horse')
-        UserAward.objects.get_or_create(user=user, award=award)
-        return True
+    def is_earned(self, data):
+        return len(data.metric_weeks) >= 6
 
-    from django.db.models import Q
-
-    assignments = Assignment.objects.all()
-
-    for assignment in assignments:
-        import re
-        week_match = re.search(r'Week (\d+)', assignment.name)
-        if not week_match:
-            continue
-
-        week_number = int(week_match.group(1))
-
-        # Check Cpp and Rust
-        for language in ['cpp', 'rust']:
-            benchmark_pattern_with_underscore = f"BM_W{week_number}_"
-            benchmark_pattern_without_underscore = f"BM_W{week_number}"
-
-            users_with_benchmarks = User.objects.filter(
-                (Q(benchmarkresult__metrics__benchmark_name__startswith=benchmark_pattern_with_underscore) |
-                Q(benchmarkresult__metrics__benchmark_name=benchmark_pattern_without_underscore)) &
-                Q(benchmarkresult__language=language)
-            ).distinct()
-
-            user_times = {}
-            for u in users_with_benchmarks:
-                metrics = BenchmarkMetric.objects.filter(
-                    Q(benchmark_result__user=u) &
-                    Q(benchmark_result__language=language) &
-                    (Q(benchmark_name__startswith=benchmark_pattern_with_underscore) |
-                    Q(benchmark_name=benchmark_pattern_without_underscore))
-                ).order_by('-benchmark_result__submission_time')
-
-                if metrics.exists():
-                    user_times[u.id] = metrics.first().cpu_time
-
-            sorted_users = sorted(
-                users_with_benchmarks,
-                key=lambda us: user_times.get(us.id, float('inf'))
-            )
-
-            if sorted_users and sorted_users[0] == user:
-                award = Award.objects.get(name='High Score Horse')
-                UserAward.objects.get_or_create(user=user, award=award)
-                return True
 
-    return False
+class NightOwl(TimeOfDayRule):
+    name = 'Night Owl'
+    description = 'Push a completed assignment between 23:00 and 5:00'
+    start_hour = 23
+    end_hour = 5
 
-def check_rank_based_awards(user, current_rank):
+
+class WeekendWarrior(AwardRule):
     """
-    Check for rank-based awards
+    the submission was on a sat/sun. Older submissions were already checked when they came in
     """
-    if current_rank == 1: # winning whale. others could be added at some point
-        award = Award.objects.get(name='Winning Whale')
-        UserAward.objects.get_or_create(user=user, award=award)
+    name = 'Weekend Warrior'
+    description = 'Push a completed assignment on a Saturday or Sunday'
+    requires = ('submission_time',)
+    events = (SubmissionIngested,)
+    replayable = True
+
+    def is_earned(self, data):
+        return is_weekend(data.submission_time)
+
+
+class HalfwayHero(AwardRule):
+    name = 'Halfway Hero'
+    description = 'Complete 50% of all assignment'
+    requires = ('performances', 'total_assignments')
+    events = (AssignmentCompleted,)
+
+    def is_earned(self, data):
+        return len(data.performances) >= data.total_assignments * 0.5
+
+
+class WinningWhale(AwardRule):
+    name = 'Winning Whale'
+    description = 'Reach first place'
+    requires = ('current_rank',)
+    events = (RankChanged,)
+
+    def is_earned(self, data):
+        return data.current_rank == 1
+
+
+class MomentumMonkey(AwardRule):
+    name = 'Momentum Monkey'
+    description = 'Stay in the top 5 for 3 consecutive weeks'
+    requires = ('rank_history',)
+    events = (RankChanged,)
+
+    def is_earned(self, data):
+        return any(all(rank <= 5 for rank in sequence) for sequence in find_sequence(3, data.rank_history))
 
-def check_steady_sailor(user, ranks_history):
+
+class ComebackKid(AwardRule):
     """
-    Check if user stayed in same rank for 3 consecutive weeks
+    The number 5 may be too much if not enough people partake in one of the langs
     """
-    length = 3
-    consecutive_ranks = find_sequence(length, ranks_history)
+    name = 'Comeback Kid'
+    description = 'Jump 5 ranks in 1 week'
+    requires = ('rank_history',)
+    events = (RankChanged,)
+
+    def is_earned(self, data):
+        ranks = data.rank_history
+        for current_rank, next_rank in zip(ranks, ranks[1:]):
+            if current_rank > 0 and next_rank > 0 and current_rank - next_rank >= 5:
+                return True
+        return False
 
-    for sequence in consecutive_ranks:
-        if len(set(sequence)) == 1:  # check if all values in sequence are the sme
-            award = Award.objects.get(name='Steady Sailor')
-            UserAward.objects.get_or_create(user=user, award=award)
-            return
 
+class HighScoreHorse(AwardRule):
+    """
+    Nobody can become first without a submission changing the leader, so this is only checked then.
+    `manage.py rebuild_derived` replays it for past submissions
+    """
+    name = 'High Score Horse'
+    description = 'Be in first place for an assignment'
+    requires = ('leader_weeks',)
+    events = (SubmissionIngested,)
+    replayable = True
 
+    def is_earned(self, data):
+        # the user took first place with this submission, even if somebody else has overtaken them by now
+        return bool(data.leader_weeks)
 
 
-def check_tortoise_triumph(user, ranks_history):
+class DemonstrationDodo(AwardRule):
     """
-    Check if user climbed ranks for 4 consec. weeks
+    given out by admins to students who presented in class
     """
+    name = 'Demonstration Dodo'
+    description = 'Present your work in class'
+    manual = True
 
-    consecutive_ranks = find_sequence(4, ranks_history)
-    for sequence in consecutive_ranks:
 
-        improving = True
-        for i in range(len(sequence) - 1):
-            if sequence[i] >= sequence[i + 1]:
-                improving = False
-                break
+class PunctualPeacock(AwardRule):
+    """
+    For this it is important that adnins actually set enddates
+    """
+    name = 'Punctual Peacock'
+    description = 'Hand in every assignment before the deadline'
+    requires = ('performances',)
+    # the end dates are final once the assignment is closed
+    events = (AssignmentCompleted, AssignmentClosed)
+    replayable = True
+
+    def is_earned(self, data):
+        # Can only be achieved when the last (6th) assignment is submitted
+        if len(data.performances) < 6:
+            return False
+
+        return all(
+            not perf.assignment.end_date or perf.submission_time <= perf.assignment.end_date
+            for perf in data.performances
+        )
 
-        if improving:
-            award = Award.objects.get(name='Tortoise Triumph')
-            UserAward.objects.get_or_create(user=user, award=award)
-            return
 
-def check_momentum_monkey(user, ranks_history):
+class TimelyToucan(AwardRule):
     """
-    Check if user stayed in top 5 for 3 consec weeks
+    I think this award makes some sense, since it shows 1) they submit assignment on time and 2) they took their time
+    I can imagine, that this could lead to people doing it in the last second, though.
     """
-    consecutive_ranks = find_sequence(3, ranks_history)
+    name = 'Timely Toucan'
+    description = 'Hand in an assignment the day it is due'
+    requires = ('performances',)
+    events = (AssignmentCompleted, AssignmentClosed)
+    replayable = True
+
+    def is_earned(self, data):
+        return any(
+            perf.assignment.end_date and perf.submission_time.date() == perf.assignment.end_date.date()
+            for perf in data.performances
+        )
+
+
+class ExcellentElephant(AwardRule):
+    name = 'Excellent Elephant'
+    description = 'Be in the top 3'
+    requires = ('current_rank',)
+    events = (RankChanged,)
 
-    for sequence in consecutive_ranks:
-        if all(rank <= 5 for rank in sequence):  # All ranks in sequence in top 5
-            award = Award.objects.get(name='Momentum Monkey')
-            UserAward.objects.get_or_create(user=user, award=award)
-            return
+    def is_earned(self, data):
+        # rank 0 means the user has no rank yet
+        return 0 < data.current_rank <= 3
 
-def check_comeback_kid(user, ranks_history):
+
+# Award definitions
+AWARDS = [
+    EarlyBird(),
+    SteadySailor(),
+    TortoiseTriumph(),
+    DatabaseDevil(),
+    NightOwl(),
+    WeekendWarrior(),
+    HalfwayHero(),
+    WinningWhale(),
+    MomentumMonkey(),
+    ComebackKid(),
+    HighScoreHorse(),
+    DemonstrationDodo(),
+    PunctualPeacock(),
+    TimelyToucan(),
+    ExcellentElephant(),
+]
+
+REPLAYABLE_AWARDS = [rule for rule in AWARDS if rule.replayable]
+
+
+class AwardData:
     """
-    Check if user jumped 5 ranks in 1 week. The number 5 may be too much if not enough people partake in one of the langs
+    Everything the award rules need to know about a user.
+    Data from the database is loaded on first access, so it is loaded at most once and only if a rule needs it.
     """
-    for i in range(len(ranks_history) - 1):
-        current_rank = ranks_history[i]
-        next_rank = ranks_history[i + 1]
+    def __init__(self, user, submission_time=None, ranks_history=None, current_rank=None, leader_weeks=()):
+        self.user = user
+        self.submission_time = submission_time
+        self.current_rank = current_rank
+        self.leader_weeks = list(leader_weeks)
+        self.rank_history = [rank for rank in (ranks_history or []) if rank is not None]
+
+    def has(self, requirement):
+        """
+        data passed in by the caller may be missing, everything else can always be loaded
+        """
+        if requirement == 'submission_time':
+            return self.submission_time is not None
+        if requirement == 'current_rank':
+            return self.current_rank is not None
+        if requirement == 'rank_history':
+            return bool(self.rank_history)
+        if requirement == 'leader_weeks':
+            return bool(self.leader_weeks)
+        return True
 
-        if current_rank is not None and next_rank is not None and current_rank > 0 and next_rank > 0:
+    @cached_property
+    def performances(self):
+        return list(Performance.objects.filter(user=self.user).select_related('assignment'))
+
+    @cached_property
+    def total_assignments(self):
+        return Performance.objects.values('assignment').distinct().count()
+
+    @cached_property
+    def metric_weeks(self):
+        """
+        weeks the user has benchmarks for
+        """
+        return set(
+            BenchmarkMetric.objects.filter(user=self.user, week_number__isnull=False)
+            .values_list('week_number', flat=True)
+            .distinct()
+        )
 
-            rank_improvement = current_rank - next_rank
-            if rank_improvement >= 5:
-                award = Award.objects.get(name='Comeback Kid')
-                UserAward.objects.get_or_create(user=user, award=award)
-                return
 
-def check_halfway_hero(user):
+def initialize_awards():
     """
-    Check if user completed 50% of all assignments.
+    Initialize awards in the database.
+    This runs after every `migrate` (see apps.py), so it usually doesn't have to be called by hand.
+    If theres an issue with any awards/if new awards were added & it doens't work as expected, this is often the solution
     """
-    total_assignments = Performance.objects.values('assignment').distinct().count()
-    user_completed = Performance.objects.filter(user=user).count()
+    for rule in AWARDS:
+        Award.objects.get_or_create(
+            name=rule.name,
+            defaults={'description': rule.description}
+        )
+    invalidate_award_catalog()
+
+
+# (award catalog version, name -> Award), shared by all requests of this process
+_award_catalog = None
+_award_catalog_lock = threading.Lock()
 
-    if user_completed >= total_assignments * 0.5:
-        award = Award.objects.get(name='Halfway Hero')
-        UserAward.objects.get_or_create(user=user, award=award)
 
-def check_punctual_peacock(user):
+def get_award_catalog():
     """
-    Check if user has submitted all assignments before their deadlines.
-    For this it is important that adnins actually set enddates
+    All awards by name. They are loaded from the db once per process and kept until the award catalog version changes,
+    which happens when awards are changed (see invalidate_award_catalog). Checking the version is one small query,
+    so changes made in the admin panel are seen by every process, including the worker.
     """
+    global _award_catalog
 
-    user_performances = Performance.objects.filter(user=user)
-    user_completed = user_performances.count()
+    version = get_award_catalog_version()
+    catalog = _award_catalog
+    if catalog is None or catalog[0] != version:
+        with _award_catalog_lock:
+            catalog = _award_catalog
+            if catalog is None or catalog[0] != version:
+                catalog = (version, {award.name: award for award in Award.objects.order_by('pk')})
+                _award_catalog = catalog
+    return catalog[1]
 
-    # Can only be achieved when the last (6th) assignment is submitted
-    if user_completed < 6:
-        return
 
-    all_on_time = True
-    for performance in user_performances:
-        assignment = performance.assignment
-        if assignment.end_date and performance.submission_time > assignment.end_date:
-            all_on_time = False
-            break
+def invalidate_award_catalog():
+    """
+    Has to be called after awards were added, changed or deleted. All processes reload them on their next access
+    """
+    global _award_catalog
+    bump_award_catalog_version()
+    _award_catalog = None
 
-    if all_on_time:
-        award = Award.objects.get(name='Punctual Peacock')
-        UserAward.objects.get_or_create(user=user, award=award)
 
-def check_timely_toucan(user, performance=None):
+def evaluate_awards(data, rules=None):
     """
-    Check if user has submitted an assignment on the day it is due
-    I think this award makes some sense, since it shows 1) they submit assignment on time and 2) they took their time
-    I can imagine, that this could lead to people doing it in the last second, though.
+    Evaluates the award rules for the user in data.
+    Rules whose award the user already holds are skipped, new awards are written with a single query.
+    Returns the newly earned awards.
     """
-    print("\nChecking Timely Toucan award...")
+    rules = AWARDS if rules is None else rules
+    awards = get_award_catalog()
+    rules = [
+        rule for rule in rules
+        if not rule.manual and rule.name in awards and all(data.has(requirement) for requirement in rule.requires)
+    ]
+    if not rules:
+        return []
+
+    earned = set(UserAward.objects.filter(user=data.user).values_list('award__name', flat=True))
+
+    new_awards = []
+    for rule in rules:
+        if rule.name not in earned and rule.is_earned(data):
+            new_awards.append(awards[rule.name])
+
+    if new_awards:
+        UserAward.objects.bulk_create(
+            [UserAward(user=data.user, award=award) for award in new_awards],
+            ignore_conflicts=True
+        )
+        bump_leaderboard_version()
+    return new_awards
+
 
-    if performance:
-        assignment = performance.assignment
-        if not assignment.end_date:
-            return
+def replay_awards(performances=(), submission_time=None, leader_weeks=()):
+    """
+    Names of the replayable awards earned with a single submission (submission_time and the weeks in which it took
+    first place) or with the given performances.
+    Nothing is read from or written to the db, so this can also run in another process
+    """
+    data = AwardData(None, submission_time=submission_time, leader_weeks=leader_weeks)
+    # given instead of loaded from the db
+    data.performances = list(performances)
+    return {
+        rule.name for rule in REPLAYABLE_AWARDS
+        if all(data.has(requirement) for requirement in rule.requires) and rule.is_earned(data)
+    }
 
-        submission_date = performance.submission_time.date()
-        deadline_date = assignment.end_date.date()
 
-        if submission_date == deadline_date:
-            award = Award.objects.get(name='Timely Toucan')
-            UserAward.objects.get_or_create(user=user, award=award)
-    else:
-        performances = Performance.objects.filter(user=user)
-        for perf in performances:
-            assignment = perf.assignment
-            if not assignment.end_date:
-                continue
+def rules_for(event_type):
+    return [rule for rule in AWARDS if event_type in rule.events]
 
-            submission_date = perf.submission_time.date()
-            deadline_date = assignment.end_date.date()
 
-            if submission_date == deadline_date:
-                award = Award.objects.get(name='Timely Toucan')
-                UserAward.objects.get_or_create(user=user, award=award)
-                return
+@subscribe(SubmissionIngested)
+def on_submission_ingested(event):
+    evaluate_awards(AwardData(
+        event.user,
+        submission_time=event.submission_time,
+        leader_weeks=event.leader_weeks
+    ), rules_for(SubmissionIngested))
 
 
-def check_excellent_elephant(user, current_rank=None):
-    """
-    Check if user is in the top 3
-    """
+@subscribe(AssignmentCompleted)
+def on_assignment_completed(event):
+    evaluate_awards(AwardData(event.user), rules_for(AssignmentCompleted))
 
-    if current_rank is not None and current_rank <= 3:
-        award = Award.objects.get(name='Excellent Elephant')
-        UserAward.objects.get_or_create(user=user, award=award)
 
-def check_database_devil(user):
+@subscribe(RankChanged)
+def on_rank_changed(event):
+    evaluate_awards(AwardData(
+        event.user,
+        ranks_history=event.ranks_history,
+        current_rank=event.current_rank
+    ), rules_for(RankChanged))
+
+
+@subscribe(AssignmentClosed)
+def on_assignment_closed(event):
     """
-    Check if user has benchmarks for 6 weeks.
-    This implies that the tests for all 6 wekks passed, since the bm stage wouldnt otherwise be reached -> user implemented db
+    Deadline awards are checked once more for everyone who handed in one of the closed assignments,
+    in case the end date was changed after they pushed
     """
-    print("\nChecking Database Devil award...")
-
-    weeks_with_benchmarks = set()
-
-    metrics = BenchmarkMetric.objects.filter(benchmark_result__user=user)
-
-    for metric in metrics:
-        import re
-        week_match = re.search(r'W(\d+)', metric.benchmark_name)
-        if week_match:
-            week_number = int(week_match.group(1))
-            weeks_with_benchmarks.add(week_number)
-
-
-    if len(weeks_with_benchmarks) >= 6:
-        award = Award.objects.get(name='Database Devil')
-        UserAward.objects.get_or_create(user=user, award=award)
-
-def check_awards(user, submission_time=None, ranks_history=None, current_rank=None, performance=None):
-    valid_ranks = []
-    if ranks_history:
-        valid_ranks = [rank for rank in ranks_history if rank is not None]
-
-    if submission_time:
-        # early bird
-        check_time_based_award(user, submission_time, 5, 9, 'Early Bird')
-        # night owl
-        check_time_based_award(user, submission_time, 23, 5, 'Night Owl')
-        # weekend warrior
-        check_weekend_warrior(user, submission_time)
-
-        if performance:
-            check_timely_toucan(user, performance)
-
-    if current_rank is not None:
-        #winning whale
-        check_rank_based_awards(user, current_rank)
-        #excellent elephat
-        check_excellent_elephant(user, current_rank)
-
-    check_high_score_horse(user, current_rank)
-
-    if valid_ranks:
-        # steady sailor
-        check_steady_sailor(user, valid_ranks)
-        # tortoise triumph
-        check_tortoise_triumph(user, valid_ranks)
-        #momentum monkey
-        check_momentum_monkey(user, valid_ranks)
-        #comeback kid
-        check_comeback_kid(user, valid_ranks)
-
-    #halfway hero
-    check_halfway_hero(user)
-    # punctual peacock
-    check_punctual_peacock(user)
-    # database devil
-    check_database_devil(user)
-    #timely toucan
-    check_timely_toucan(user)
-
-    earned_awards = UserAward.objects.filter(user=user)
-    print("\nCurrently earned awards:")
-    for user_award in earned_awards:
-        print(f"- {user_award.award.name}")
+    names = [f"Week {week_number}" for week_number in event.week_numbers]
+    rules = rules_for(AssignmentClosed)
+    for user in User.objects.filter(performance__assignment__name__in=names).distinct():
+        evaluate_awards(AwardData(user), rules)
+
+
+@subscribe(AwardRevoked)
+def on_award_revoked(event):
+    # the dashboard and scoreboard show the awards
+    bump_leaderboard_version()
+
+
+def is_weekend(submission_time):
+    if submission_time.tzinfo is None:
+        submission_time = timezone.make_aware(submission_time)
+    return submission_time.weekday() >= 5  # 5 is Saturday, 6 is Sunday
+
 
 def find_sequence(length, ranks_history):
     consecutive_ranks = []
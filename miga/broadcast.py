@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+from asgiref.sync import sync_to_async
+
+from .ranking import get_live_board
+
+
+class ScoreboardBroadcaster:
+    """
+    Pushes scoreboard changes to all clients watching a (week, language) board.
+    A board is computed once per change, no matter how many clients are connected, and only the difference
+    to the previous state is sent.
+    This lives in the process of the ASGI server. Changes are published by the ingest after its transaction committed.
+    """
+    def __init__(self):
+        self._subscribers = {}  # (week, language) -> set of queues
+        self._boards = {}  # (week, language) -> last board that was sent
+        self._loop = None
+        self._lock = threading.Lock()
+
+    async def subscribe(self, week_number, language):
+        """
+        Returns a queue that receives the board changes, and the current board
+        """
+        key = (week_number, language)
+        self._loop = asyncio.get_running_loop()
+
+        queue = asyncio.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(queue)
+
+        board = self._boards.get(key)
+        if board is None:
+            board = await sync_to_async(get_live_board)(week_number, language)
+            self._boards[key] = board
+
+        return queue, board
+
+    def unsubscribe(self, week_number, language, queue):
+        key = (week_number, language)
+        with self._lock:
+            subscribers = self._subscribers.get(key, set())
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop(key, None)
+                self._boards.pop(key, None)
+
+    def publish(self, language, week_numbers):
+        """
+        Can be called from any thread. Does nothing if nobody is watching the boards
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+
+        with self._lock:
+            keys = [(week_number, language) for week_number in week_numbers if (week_number, language) in self._subscribers]
+
+        for key in keys:
+            loop.call_soon_threadsafe(lambda key=key: loop.create_task(self._refresh(key)))
+
+    async def _refresh(self, key):
+        week_number, language = key
+        board = await sync_to_async(get_live_board)(week_number, language)
+
+        delta = get_board_delta(self._boards.get(key), board)
+        self._boards[key] = board
+        if delta is None:
+            return
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+
+        for queue in subscribers:
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # a client that doesn't read anymore shouldn't slow down the others
+                pass
+
+
+def get_board_delta(old_board, new_board):
+    """
+    What changed between two boards: the ranks that changed, and the displayed rows if they changed.
+    None if nothing changed
+    """
+    old_ranks = old_board['ranks'] if old_board else {}
+    old_rows = old_board['rows'] if old_board else None
+
+    changed_ranks = {
+        user_id: rank
+        for user_id, rank in new_board['ranks'].items()
+        if old_ranks.get(user_id) != rank
+    }
+
+    delta = {}
+    if changed_ranks:
+        delta['ranks'] = changed_ranks
+    if new_board['rows'] != old_rows:
+        delta['rows'] = new_board['rows']
+
+    return delta or None
+
+
+broadcaster = ScoreboardBroadcaster()
@@ -0,0 +1,88 @@
+from django.core.cache import cache
+from django.db.models import F
+
+from .instrumentation import cache_stats
+from .models import LeaderboardVersion, new_version_token
+
+# pages are cached for at most this long, usually they are invalidated way earlier by a new version
+CACHE_TIMEOUT = 60 * 60
+CACHED_VIEWS = ['dashboard', 'scoreboard']
+
+
+def get_leaderboard_version():
+    """
+    Version and token of the leaderboard, used in cache keys and ETags. The row is created on first use,
+    so a new db never shares the keys of an old one
+    """
+    row = LeaderboardVersion.objects.filter(pk=1).values_list('version', 'token').first()
+    if row is None:
+        version, _ = LeaderboardVersion.objects.get_or_create(pk=1)
+        row = (version.version, version.token)
+    return f"{row[0]}-{row[1]}"
+
+
+def get_award_catalog_version():
+    return LeaderboardVersion.objects.filter(pk=1).values_list('award_catalog_version', flat=True).first() or 0
+
+
+def _bump(field, **changes):
+    """
+    The update is done by the db, so it is atomic across processes,
+    and when called inside a transaction the new version only becomes visible together with the new data
+    """
+    updated = LeaderboardVersion.objects.filter(pk=1).update(**{field: F(field) + 1}, **changes)
+    if not updated:
+        version, created = LeaderboardVersion.objects.get_or_create(pk=1, defaults={field: 1, **changes})
+        if not created:
+            LeaderboardVersion.objects.filter(pk=1).update(**{field: F(field) + 1}, **changes)
+
+
+def bump_leaderboard_version():
+    """
+    Invalidates all cached pages. The token is new as well, so after a backup was restored the version numbers
+    that come next don't match pages that were cached before the restore
+    """
+    _bump('version', token=new_version_token())
+
+
+def bump_award_catalog_version():
+    """
+    Makes every process reload the awards (see awards.get_award_catalog)
+    """
+    _bump('award_catalog_version')
+
+
+def get_cached(view_name, compute, user=None, language=None, week=None):
+    """
+    Returns the cached data of a view, or computes and caches it.
+    The key contains the leaderboard version, so data is never served after something changed
+    """
+    user_id = user.id if user is not None else None
+    key = f"miga:{view_name}:{user_id}:{language}:{week}:{get_leaderboard_version()}"
+
+    data = cache.get(key)
+    cache_stats.record(view_name, hit=data is not None)
+    if data is not None:
+        return data
+
+    data = compute()
+    cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def get_cache_stats():
+    """
+    Hits and misses per view of this process, like the request statistics
+    """
+    stats = {}
+    for view_name in CACHED_VIEWS:
+        hits, misses = cache_stats.get(view_name)
+        total = hits + misses
+        stats[view_name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 3) if total else None,
+        }
+    stats['leaderboard_version'] = get_leaderboard_version()
+    return stats
+
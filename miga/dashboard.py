@@ -0,0 +1,54 @@
+from django.db.models import Count, Q
+
+from .awards import get_award_catalog
+from .models import RankSnapshot, TotalScore, UserAward
+from .ranking import LANGUAGES, WEEK_NUMBERS
+
+
+def load_dashboard(user):
+    """
+    Everything shown on the dashboard, for all languages at once: the rank per week, total score and overall rank,
+    and the awards. This always takes 5 queries, no matter how many users there are
+    (the awards themselves come from the award catalog, see awards.py, which only checks its version).
+    Nothing is written here, awards are checked by the worker after a submission
+    """
+    ranks = {language: {} for language in LANGUAGES}
+    for language, week_number, rank in RankSnapshot.objects.filter(user=user).values_list(
+            'language', 'week_number', 'rank'):
+        ranks[language][week_number] = rank
+
+    scores = dict(TotalScore.objects.filter(user=user).values_list('language', 'score'))
+
+    # number of users with a higher total score, for every language in one query
+    higher_scores = TotalScore.objects.aggregate(**{
+        language: Count('pk', filter=Q(language=language, score__gt=scores.get(language, 0)))
+        for language in LANGUAGES
+    })
+
+    earned = set(UserAward.objects.filter(user=user).values_list('award_id', flat=True))
+
+    languages = {}
+    for language in LANGUAGES:
+        ranking_history = [ranks[language].get(week) for week in WEEK_NUMBERS]
+        valid_ranks = [rank for rank in ranking_history if rank is not None]
+        languages[language] = {
+            'language': language,
+            'week_labels': [f"Week {week}" for week in WEEK_NUMBERS],
+            'ranking_history': ranking_history,
+            'best_rank': min(valid_ranks) if valid_ranks else None,
+            'total_score': scores.get(language, 0),
+            'total_rank': higher_scores[language] + 1,
+        }
+
+    return {
+        'languages': languages,
+        'awards': [
+            {
+                'name': award.name,
+                'description': award.description,
+                'image_name': award.image_name,
+                'earned': award.id in earned
+            }
+            for award in get_award_catalog().values()
+        ],
+    }
@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+
+def is_lock_error(error):
+    """
+    sqlite raises these when another connection holds the write lock for longer than the busy timeout
+    """
+    message = str(error).lower()
+    return isinstance(error, OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_lock(func, *args, **kwargs):
+    """
+    Calls func, and calls it again with exponential backoff (plus some jitter, so retries of parallel pushes don't
+    collide again) if the db was locked. Must not be called inside a transaction, since the whole transaction has
+    to be repeated. After MIGA_DB_LOCK_RETRIES retries the error is raised
+    """
+    retries = getattr(settings, 'MIGA_DB_LOCK_RETRIES', 5)
+    delay = 0.05
+
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as error:
+            if not is_lock_error(error) or attempt == retries or connection.in_atomic_block:
+                raise
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay *= 2
+
+
+@contextmanager
+def dry_run_atomic(dry_run):
+    """
+    A transaction for the writes of a management command. With dry_run, everything is computed and written
+    the same way, but rolled back at the end, so a dry run reports the real numbers
+    """
+    with transaction.atomic():
+        yield
+        if dry_run:
+            transaction.set_rollback(True)
+
+
+class SerializedWriter:
+    """
+    Runs writes one after another on a single thread of this process, so parallel pushes wait in line
+    instead of fighting over sqlite's write lock (and reads never have to wait for more than one writer)
+    """
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='miga-writer')
+        return self._executor.submit(retry_on_lock, func, *args, **kwargs).result()
+
+
+writer = SerializedWriter()
+
+
+def run_write(func, *args, **kwargs):
+    """
+    Runs a function that writes to the db, retrying it if the db is locked.
+    With MIGA_SINGLE_WRITER, it runs on the writer thread, the caller waits for the result
+    """
+    if getattr(settings, 'MIGA_SINGLE_WRITER', False):
+        return writer.submit(func, *args, **kwargs)
+    return retry_on_lock(func, *args, **kwargs)
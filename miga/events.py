@@ -0,0 +1,85 @@
+"""
+Things that happened, published by the code that made them happen and handled by whoever subscribed to them.
+Award rules declare the events that can change whether they are earned (see awards.py), so a push only
+evaluates the rules that can actually be affected by it.
+Subscribers run right away in the publishing thread, usually the worker.
+"""
+
+
+class Event:
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value!r}' for name, value in vars(self).items())
+        return f'{type(self).__name__}({fields})'
+
+
+class SubmissionIngested(Event):
+    """
+    A push was stored. leader_weeks are the weeks in which it took (or shared) first place
+    """
+    def __init__(self, user, language, submission_time, week_numbers=(), leader_weeks=()):
+        self.user = user
+        self.language = language
+        self.submission_time = submission_time
+        self.week_numbers = list(week_numbers)
+        self.leader_weeks = list(leader_weeks)
+
+
+class AssignmentCompleted(Event):
+    """
+    A push gave the user a performance for assignments they had none for yet
+    """
+    def __init__(self, user, week_numbers):
+        self.user = user
+        self.week_numbers = list(week_numbers)
+
+
+class RankChanged(Event):
+    """
+    The ranks of the user changed since their last push. ranks_history has the rank of every week the user is ranked in,
+    current_rank is the better one of the rank in the current week and the overall rank (0 if there is none)
+    """
+    def __init__(self, user, language, ranks_history, current_rank):
+        self.user = user
+        self.language = language
+        self.ranks_history = list(ranks_history)
+        self.current_rank = current_rank
+
+
+class AssignmentClosed(Event):
+    """
+    The end date of these weeks' assignments passed, their ranks are final
+    """
+    def __init__(self, week_numbers):
+        self.week_numbers = list(week_numbers)
+
+
+class AwardRevoked(Event):
+    """
+    An award was taken away from a user, by an admin or by `manage.py rebuild_derived --revoke`
+    """
+    def __init__(self, user_id, award_name):
+        self.user_id = user_id
+        self.award_name = award_name
+
+
+# event class -> functions called with every published event of that class
+SUBSCRIBERS = {}
+
+
+def subscribe(*event_types):
+    """
+    Registers the decorated function as a subscriber of the given event classes
+    """
+    def register(func):
+        for event_type in event_types:
+            SUBSCRIBERS.setdefault(event_type, []).append(func)
+        return func
+    return register
+
+
+def publish(event):
+    """
+    Calls all subscribers of the event's class. Errors are not caught, the caller (e.g. a job) fails with them
+    """
+    for subscriber in SUBSCRIBERS.get(type(event), []):
+        subscriber(event)
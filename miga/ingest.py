@@ -0,0 +1,222 @@
+from django.db import transaction
+from django.db.models import F, Subquery
+
+from .models import (Assignment, BenchmarkPayload, BenchmarkResult, BenchmarkMetric, Performance, RankSnapshot, User,
+                     parse_week_number)
+from .leaderboard import (assignment_has_ended, get_leading_times, get_total_rank, get_total_score, record_benchmark,
+                          update_rank_snapshots, update_total_score)
+from .ranking import WEEK_NUMBERS, get_user_ranks
+from .cache import bump_leaderboard_version
+from .broadcast import broadcaster
+from .events import AssignmentCompleted, RankChanged, SubmissionIngested, publish
+
+
+def parse_benchmarks(raw_data):
+    """
+    Parses the benchmarks of a Google Benchmark JSON once.
+    Returns a list of (week_number, benchmark) for all benchmarks that belong to a week
+    """
+    parsed = []
+    for benchmark in raw_data.get('benchmarks', []):
+        name = benchmark.get('name', '')
+        if not name:
+            continue
+
+        week_number = parse_week_number(name)
+        if week_number is not None:
+            parsed.append((week_number, benchmark))
+
+    return parsed
+
+
+def get_assignments_by_week(week_numbers):
+    """
+    Maps week numbers to their assignment with one query. Missing assignments are created
+    """
+    names = {week_number: f"Week {week_number}" for week_number in week_numbers}
+    assignments_by_name = {
+        assignment.name: assignment
+        for assignment in Assignment.objects.filter(name__in=names.values())
+    }
+
+    assignments = {}
+    for week_number, name in names.items():
+        assignment = assignments_by_name.get(name)
+        if assignment is None:
+            assignment, _ = Assignment.objects.get_or_create(
+                name=name,
+                defaults={'description': f'Assignment for Week {week_number}'}
+            )
+        assignments[week_number] = assignment
+
+    return assignments
+
+
+def update_performances(user, best_metrics):
+    """
+    Updates the user's performance for each assignment in best_metrics ({assignment: metric}) if the metric is faster,
+    then adds the difference to the user's totals.
+    bulk_create/bulk_update skip Performance.save(), so the totals are updated here with a single query.
+    Returns the ids of the assignments the user got their first performance for
+    """
+    existing = {
+        performance.assignment_id: performance
+        for performance in Performance.objects.filter(user=user, assignment__in=best_metrics.keys())
+    }
+
+    created = []
+    improved = []
+    score_delta = 0
+    for assignment, metric in best_metrics.items():
+        performance = existing.get(assignment.id)
+        if performance is None:
+            created.append(Performance(
+                user=user,
+                assignment=assignment,
+                score=metric.cpu_time,
+                completion_time=0,
+                cpu_time=metric.cpu_time
+            ))
+            score_delta += int(metric.cpu_time)
+        elif performance.cpu_time is None or metric.cpu_time < performance.cpu_time:
+            score_delta += int(metric.cpu_time) - performance.score
+            performance.score = metric.cpu_time
+            performance.cpu_time = metric.cpu_time
+            improved.append(performance)
+
+    if created:
+        Performance.objects.bulk_create(created)
+    if improved:
+        Performance.objects.bulk_update(improved, ['score', 'cpu_time'])
+
+    if created or improved:
+        User.objects.filter(pk=user.pk).update(
+            total_score=F('total_score') + score_delta,
+            assignments_completed=F('assignments_completed') + len(created)
+        )
+
+    return {performance.assignment_id for performance in created}
+
+
+def ingest_submission(user, language, raw_data):
+    """
+    Stores a benchmark submission with all its metrics in one transaction.
+    Metrics are created in bulk, and the leaderboard, performances and user totals are updated once per submission
+    instead of once per metric.
+    Returns the BenchmarkResult, the submitted week numbers, the weeks in which the user became the leader,
+    the weeks in which the user's best time improved and the weeks the user completed for the first time.
+    """
+    benchmarks = parse_benchmarks(raw_data)
+
+    with transaction.atomic():
+        benchmark_result = BenchmarkResult.objects.create(
+            user=user,
+            payload=BenchmarkPayload.store(raw_data),
+            language=language
+        )
+
+        assignments = get_assignments_by_week({week_number for week_number, _ in benchmarks})
+
+        # bulk_create skips BenchmarkMetric.save(), the assignment and week are already resolved here
+        metrics = BenchmarkMetric.objects.bulk_create([
+            BenchmarkMetric(
+                benchmark_result=benchmark_result,
+                benchmark_name=benchmark['name'],
+                assignment=assignments[week_number],
+                cpu_time=benchmark.get('cpu_time', 0),
+                real_time=benchmark.get('real_time', 0),
+                iterations=benchmark.get('iterations', 0),
+                week_number=week_number,
+                language=language,
+                user=user
+            )
+            for week_number, benchmark in benchmarks
+        ])
+
+        # fastest metric of this submission per week
+        best_metrics = {}
+        for (week_number, _), metric in zip(benchmarks, metrics):
+            if week_number not in best_metrics or metric.cpu_time < best_metrics[week_number].cpu_time:
+                best_metrics[week_number] = metric
+
+        # assignments that are already over don't count anymore
+        best_metrics = {
+            week_number: metric
+            for week_number, metric in best_metrics.items()
+            if not assignment_has_ended(assignments[week_number])
+        }
+
+        # weeks in which this submission takes (or shares) first place
+        leading_times = get_leading_times(language, best_metrics.keys())
+        leader_weeks = [
+            week_number
+            for week_number, metric in best_metrics.items()
+            if week_number not in leading_times or metric.cpu_time <= leading_times[week_number]
+        ]
+
+        improved_weeks = [
+            week_number
+            for week_number, metric in best_metrics.items()
+            if record_benchmark(user, language, week_number, metric.cpu_time, metric)
+        ]
+
+        if improved_weeks:
+            update_total_score(user, language)
+            update_rank_snapshots(language, improved_weeks)
+            bump_leaderboard_version()
+            # live scoreboards are only updated once the new data is visible to everyone
+            transaction.on_commit(lambda: broadcaster.publish(language, improved_weeks))
+
+        completed = update_performances(
+            user, {assignments[week_number]: metric for week_number, metric in best_metrics.items()}
+        )
+        completed_weeks = [week_number for week_number in best_metrics if assignments[week_number].id in completed]
+
+    submitted_weeks = [week_number for week_number, _ in benchmarks]
+    return benchmark_result, submitted_weeks, leader_weeks, improved_weeks, completed_weeks
+
+
+def ranks_changed_since_last_push(benchmark_result):
+    """
+    Pushes of other users can move the user down, which matters for awards on the rank history.
+    Checks with one query if any of the user's ranks in the language changed since their previous push
+    """
+    previous_push = BenchmarkResult.objects.filter(
+        user_id=benchmark_result.user_id,
+        language=benchmark_result.language,
+        submission_time__lt=benchmark_result.submission_time
+    ).order_by('-submission_time').values('submission_time')[:1]
+
+    return RankSnapshot.objects.filter(
+        user_id=benchmark_result.user_id,
+        language=benchmark_result.language,
+        updated_at__gt=Subquery(previous_push)
+    ).exists()
+
+
+def process_submission(benchmark_result, week_numbers, leader_weeks=(), improved_weeks=None, completed_weeks=None):
+    """
+    Everything that has to happen after a submission was stored, but doesn't need to block the CI job:
+    the submission is published as events, and the award rules that subscribed to them are evaluated (see awards.py).
+    This is the only place where awards are given out automatically, the pages only read them.
+    improved_weeks and completed_weeks are missing for jobs that were queued before they were stored,
+    then every event is published
+    """
+    user = benchmark_result.user
+    language = benchmark_result.language
+
+    publish(SubmissionIngested(user, language, benchmark_result.submission_time, week_numbers, leader_weeks))
+
+    if completed_weeks is None or completed_weeks:
+        publish(AssignmentCompleted(user, week_numbers if completed_weeks is None else completed_weeks))
+
+    if improved_weeks is None or improved_weeks or ranks_changed_since_last_push(benchmark_result):
+        current_week = max(week_numbers) if week_numbers else 1
+        week_ranks = get_user_ranks(user, language)
+
+        # rank awards count both the rank in the current week and the overall rank
+        week_rank = week_ranks[current_week - 1] if current_week in WEEK_NUMBERS else None
+        total_rank = get_total_rank(user, language) if get_total_score(user, language) else None
+        current_rank = min([rank for rank in (week_rank, total_rank) if rank], default=0)
+
+        publish(RankChanged(user, language, [rank for rank in week_ranks if rank], current_rank))
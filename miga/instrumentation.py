@@ -0,0 +1,158 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connection
+
+# literals and IN lists are replaced, so queries that only differ in their parameters have the same fingerprint
+_FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    for pattern, replacement in _FINGERPRINT_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def percentile(values, percent):
+    """
+    nearest rank percentile of sorted values
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+class QueryRecorder:
+    """
+    Counts the queries of a request and the time spent in the db. Used as an execute wrapper (see Django docs),
+    so it also works with DEBUG off
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        """
+        queries that were run more than once with different parameters, usually an N+1
+        """
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+
+class RequestStats:
+    """
+    The last `window` requests per url name of this process
+    """
+    def __init__(self, window=500):
+        self.window = window
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def record(self, url_name, duration, query_count, db_duration, duplicates):
+        with self._lock:
+            requests = self._requests.setdefault(url_name, deque(maxlen=self.window))
+            requests.append((duration, query_count, db_duration, duplicates))
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+
+    def summary(self):
+        """
+        Per url name: latency percentiles, queries, db time and the queries that were repeated the most
+        """
+        with self._lock:
+            snapshot = {url_name: list(requests) for url_name, requests in self._requests.items()}
+
+        summary = []
+        for url_name, requests in snapshot.items():
+            durations = sorted(duration * 1000 for duration, _, _, _ in requests)
+            query_counts = sorted(query_count for _, query_count, _, _ in requests)
+            db_durations = [db_duration * 1000 for _, _, db_duration, _ in requests]
+
+            duplicates = Counter()
+            for _, _, _, request_duplicates in requests:
+                duplicates.update(request_duplicates)
+
+            summary.append({
+                'url_name': url_name,
+                'requests': len(requests),
+                'p50_ms': round(percentile(durations, 50), 1),
+                'p95_ms': round(percentile(durations, 95), 1),
+                'p99_ms': round(percentile(durations, 99), 1),
+                'max_ms': round(durations[-1], 1),
+                'mean_queries': round(sum(query_counts) / len(query_counts), 1),
+                'max_queries': query_counts[-1],
+                'mean_db_ms': round(sum(db_durations) / len(db_durations), 1),
+                # (fingerprint, number of times it was repeated in the window)
+                'duplicates': duplicates.most_common(5),
+            })
+
+        return sorted(summary, key=lambda stats: stats['p95_ms'], reverse=True)
+
+
+request_stats = RequestStats(getattr(settings, 'MIGA_REQUEST_STATS_WINDOW', 500))
+
+
+class CacheStats:
+    """
+    Cache hits and misses per view of this process. Counted in memory, so a hit doesn't cost a write to the cache
+    """
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, view_name, hit):
+        with self._lock:
+            self._counts[(view_name, hit)] += 1
+
+    def get(self, view_name):
+        with self._lock:
+            return self._counts[(view_name, True)], self._counts[(view_name, False)]
+
+
+cache_stats = CacheStats()
+
+
+class RequestStatsMiddleware:
+    """
+    Records the wall time, number of queries, db time and duplicate queries of every request in request_stats
+    and sends them in a Server-Timing header, so they show up in the network tab of the browser
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        url_name = resolver_match.view_name if resolver_match else 'unresolved'
+        request_stats.record(url_name, duration, recorder.count, recorder.duration, recorder.duplicates())
+
+        response['Server-Timing'] = (
+            f'db;desc="{recorder.count} queries";dur={recorder.duration * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}'
+        )
+        return response
@@ -0,0 +1,90 @@
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Job, BenchmarkResult
+from .ingest import process_submission
+from .db import retry_on_lock
+
+# kind -> function that runs a job of that kind
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """
+    Registers the decorated function as the handler for jobs of the given kind
+    """
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+@job_handler('process_submission')
+def handle_process_submission(job):
+    benchmark_result = BenchmarkResult.objects.select_related('user').get(pk=job.payload['benchmark_result_id'])
+    process_submission(
+        benchmark_result,
+        job.payload.get('week_numbers', []),
+        job.payload.get('leader_weeks', []),
+        job.payload.get('improved_weeks'),
+        job.payload.get('completed_weeks')
+    )
+
+
+def enqueue(kind, user=None, **payload):
+    """
+    Adds a job to the queue. With MIGA_RUN_JOBS_INLINE (e.g. for local development without a worker),
+    the job is run right away instead
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job = Job.objects.create(kind=kind, user=user, payload=payload)
+
+    if getattr(settings, 'MIGA_RUN_JOBS_INLINE', False):
+        run_job(job)
+
+    return job
+
+
+def claim_next_job():
+    """
+    Marks the oldest pending job as running and returns it, or None if the queue is empty.
+    The status is checked again in the update, so a job can only be claimed by one worker
+    """
+    while True:
+        job_id = Job.objects.filter(status=Job.PENDING).order_by('created_at', 'pk').values_list('pk', flat=True).first()
+        if job_id is None:
+            return None
+
+        with transaction.atomic():
+            claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+                status=Job.RUNNING,
+                started_at=timezone.now()
+            )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+
+
+def run_job(job):
+    """
+    Runs a job and stores the outcome. Errors are stored on the job instead of being raised.
+    If the db is locked, the job is retried a few times before it fails
+    """
+    job.status = Job.RUNNING
+    job.started_at = job.started_at or timezone.now()
+
+    try:
+        retry_on_lock(JOB_HANDLERS[job.kind], job)
+    except Exception:
+        job.status = Job.FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = Job.DONE
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'started_at', 'finished_at'])
+    return job
@@ -0,0 +1,227 @@
+from math import ceil
+
+from django.db.models import Min
+from django.utils import timezone
+
+from .cache import bump_leaderboard_version
+from .events import AssignmentClosed, publish
+from .models import LeaderboardEntry, Assignment, TotalScore, RankSnapshot
+from .ranking import LANGUAGES, WEEK_NUMBERS, ranked_entries
+
+
+def assignment_has_ended(assignment, at=None):
+    """
+    benchmarks for an assignment are not taken into account anymore once its end date has passed
+    """
+    at = at or timezone.now()
+    return bool(assignment.end_date and assignment.end_date < at)
+
+
+def record_benchmark(user, language, week_number, cpu_time, metric=None):
+    """
+    Update the user's leaderboard entry if cpu_time beats the stored best.
+    Returns True if the entry was created or improved.
+    """
+    improved = LeaderboardEntry.objects.filter(
+        user=user,
+        week_number=week_number,
+        language=language,
+        best_cpu_time__gt=cpu_time
+    ).update(best_cpu_time=cpu_time, best_metric=metric, updated_at=timezone.now())
+
+    if improved:
+        return True
+
+    _, created = LeaderboardEntry.objects.get_or_create(
+        user=user,
+        week_number=week_number,
+        language=language,
+        defaults={'best_cpu_time': cpu_time, 'best_metric': metric}
+    )
+    return created
+
+
+def calculate_week_score(cpu_time):
+    # nanoseconds -> milliseconds,  calculate score
+    cpu_time_ms = cpu_time / 1_000_000
+    week_score = 1000 - (cpu_time_ms * 100)
+    return ceil(max(0.0, week_score))  # Ensure score doesn't go negative
+
+
+def update_total_score(user, language):
+    """
+    Recalculates the user's total score for a language from their leaderboard entries
+    """
+    best_times = LeaderboardEntry.objects.filter(
+        user=user,
+        language=language,
+        week_number__in=WEEK_NUMBERS
+    ).values_list('best_cpu_time', flat=True)
+    score = sum(calculate_week_score(cpu_time) for cpu_time in best_times)
+
+    TotalScore.objects.update_or_create(user=user, language=language, defaults={'score': score})
+    return score
+
+
+def get_total_score(user, language='cpp'):
+    return TotalScore.objects.filter(user=user, language=language).values_list('score', flat=True).first() or 0
+
+
+def get_total_rank(user, language='cpp', score=None):
+    """
+    Overall rank of the user for a language: one more than the number of users with a higher total score
+    """
+    if score is None:
+        score = get_total_score(user, language)
+    return TotalScore.objects.filter(language=language, score__gt=score).count() + 1
+
+
+def get_leading_times(language, week_numbers):
+    """
+    Fastest time of every given week as {week_number: cpu_time}, with one query
+    """
+    return dict(
+        LeaderboardEntry.objects.filter(language=language, week_number__in=week_numbers)
+        .values('week_number')
+        .annotate(best=Min('best_cpu_time'))
+        .values_list('week_number', 'best')
+    )
+
+
+def write_leaderboard(best):
+    """
+    Replaces all leaderboard entries and total scores with best ({(user_id, week_number, language): (cpu_time, metric_id)})
+    and updates the rank snapshots. Cached pages are invalidated. Returns the number of entries
+    """
+    LeaderboardEntry.objects.all().delete()
+    LeaderboardEntry.objects.bulk_create([
+        LeaderboardEntry(
+            user_id=user_id,
+            week_number=week_number,
+            language=language,
+            best_cpu_time=cpu_time,
+            best_metric_id=metric_id
+        )
+        for (user_id, week_number, language), (cpu_time, metric_id) in best.items()
+    ])
+
+    total_scores = {}
+    for (user_id, week_number, language), (cpu_time, _) in best.items():
+        if week_number in WEEK_NUMBERS:
+            total_scores[(user_id, language)] = total_scores.get((user_id, language), 0) + calculate_week_score(cpu_time)
+
+    TotalScore.objects.all().delete()
+    TotalScore.objects.bulk_create([
+        TotalScore(user_id=user_id, language=language, score=score)
+        for (user_id, language), score in total_scores.items()
+    ])
+
+    for language in LANGUAGES:
+        update_rank_snapshots(language, WEEK_NUMBERS)
+    close_ended_assignments(refresh=True)
+    bump_leaderboard_version()
+
+    return len(best)
+
+
+def update_rank_snapshots(language, week_numbers, final=False):
+    """
+    Writes the current ranks of the given weeks to the rank snapshots. Only rows whose rank changed are written.
+    Weeks that are already final are skipped, unless they are being closed (final=True).
+    Returns the number of changed snapshots
+    """
+    week_numbers = [week_number for week_number in week_numbers if week_number in WEEK_NUMBERS]
+    if not week_numbers:
+        return 0
+
+    # the ranks are computed per week, so filtering the weeks first doesn't change them
+    current = {
+        (week_number, user_id): rank
+        for week_number, user_id, rank in ranked_entries([language]).filter(
+            week_number__in=week_numbers
+        ).values_list('week_number', 'user_id', 'rank')
+    }
+    existing = {
+        (snapshot.week_number, snapshot.user_id): snapshot
+        for snapshot in RankSnapshot.objects.filter(language=language, week_number__in=week_numbers)
+    }
+    final_weeks = set() if final else {key[0] for key, snapshot in existing.items() if snapshot.final}
+    # finality follows the current end dates, a week that was reopened (its end date moved) is updated again
+    if final_weeks:
+        final_weeks &= ended_weeks()
+
+    created = []
+    changed = []
+    for (week_number, user_id), rank in current.items():
+        if week_number in final_weeks:
+            continue
+
+        snapshot = existing.get((week_number, user_id))
+        if snapshot is None:
+            created.append(RankSnapshot(
+                user_id=user_id,
+                week_number=week_number,
+                language=language,
+                rank=rank,
+                final=final
+            ))
+        elif snapshot.rank != rank or snapshot.final != final:
+            if snapshot.rank != rank:
+                snapshot.previous_rank = snapshot.rank
+                snapshot.rank = rank
+            snapshot.final = final
+            snapshot.updated_at = timezone.now()
+            changed.append(snapshot)
+
+    # users without a leaderboard entry anymore, e.g. after their benchmarks were deleted
+    removed = [
+        snapshot.pk for key, snapshot in existing.items()
+        if key not in current and key[0] not in final_weeks
+    ]
+
+    RankSnapshot.objects.bulk_create(created)
+    RankSnapshot.objects.bulk_update(changed, ['rank', 'previous_rank', 'final', 'updated_at'])
+    if removed:
+        RankSnapshot.objects.filter(pk__in=removed).delete()
+
+    return len(created) + len(changed) + len(removed)
+
+
+def ended_weeks():
+    """
+    Week numbers whose assignment has ended by now
+    """
+    ended_names = set(Assignment.objects.filter(end_date__lt=timezone.now()).values_list('name', flat=True))
+    return {week_number for week_number in WEEK_NUMBERS if f"Week {week_number}" in ended_names}
+
+
+def close_ended_assignments(refresh=False):
+    """
+    Freezes the rank snapshots of weeks whose assignment has ended and publishes AssignmentClosed for them.
+    Weeks that are frozen but whose assignment hasn't ended anymore (e.g. the end date was moved) are unfrozen.
+    Called by the worker while it is idle and after an assignment is changed in the admin panel.
+    Weeks that are already closed are skipped, unless refresh is set (e.g. after the leaderboard was rebuilt).
+    Returns the week numbers that were closed
+    """
+    ended = ended_weeks()
+    final_weeks = set(RankSnapshot.objects.filter(final=True).values_list('week_number', flat=True))
+    open_weeks = ended & set(
+        RankSnapshot.objects.filter(week_number__in=ended, final=False).values_list('week_number', flat=True)
+    )
+    closing = ended if refresh else open_weeks
+    reopened = final_weeks - ended
+
+    changed = 0
+    for language in LANGUAGES:
+        changed += update_rank_snapshots(language, reopened)
+        changed += update_rank_snapshots(language, closing, final=True)
+
+    # the dashboard and rankings show the snapshot ranks
+    if changed:
+        bump_leaderboard_version()
+
+    # only weeks that weren't closed before, a refresh doesn't close them again
+    if open_weeks:
+        publish(AssignmentClosed(sorted(open_weeks)))
+
+    return sorted(closing)
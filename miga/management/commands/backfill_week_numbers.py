@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from miga.models import BenchmarkMetric, parse_week_number
+
+"""
+Fills in week_number, language and user of benchmark metrics that were stored before these columns existed.
+New metrics get them when they are stored, so this only has to be run once after upgrading (after `migrate`),
+followed by `rebuild_leaderboard`.
+"""
+class Command(BaseCommand):
+    help = 'Parse the week number of older benchmark metrics and copy language and user from their results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of metrics updated at once')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        missing = BenchmarkMetric.objects.filter(
+            Q(week_number__isnull=True) | Q(user__isnull=True)
+        ).select_related('benchmark_result').order_by('pk')
+
+        last_pk = 0
+        updated = 0
+        while True:
+            chunk = list(missing.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                break
+
+            for metric in chunk:
+                metric.week_number = parse_week_number(metric.benchmark_name)
+                metric.language = metric.benchmark_result.language
+                metric.user_id = metric.benchmark_result.user_id
+
+            with transaction.atomic():
+                BenchmarkMetric.objects.bulk_update(chunk, ['week_number', 'language', 'user'])
+
+            updated += len(chunk)
+            last_pk = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} metric(s). Run rebuild_leaderboard to update the rankings.'))
@@ -0,0 +1,217 @@
+import gzip
+import json
+from collections import Counter
+from datetime import timedelta
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from miga.leaderboard import assignment_has_ended
+from miga.models import (Assignment, BenchmarkMetric, BenchmarkPayload, BenchmarkResult, LeaderboardEntry,
+                         LeaderboardVersion)
+
+"""
+Removes benchmark submissions that don't matter for the rankings anymore.
+For every user, week and language the submission with the best time and the last --keep-last submissions are kept,
+as well as the first submission that counted for an assignment (the submission time of the performance). Everything else
+is written to a gzipped NDJSON archive (one JSON object per line) and deleted:
+    python manage.py compact_benchmarks --keep-last 3 --dry-run
+    python manage.py compact_benchmarks --keep-last 3 --archive archive.ndjson.gz
+Submissions are only removed for the weeks they were superseded in, a submission is deleted once none of its
+benchmarks are kept anymore. The leaderboard and the performances don't change, since the best benchmarks and
+the first ones are always kept. Awards earned with a single push (e.g. Early Bird) can't be revoked by
+`rebuild_derived --revoke` anymore afterwards, since the pushes that earned them may be gone.
+"""
+class Command(BaseCommand):
+    help = 'Archive and delete benchmark submissions that were superseded by better or newer ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-last', type=int, default=3,
+                            help='Number of latest submissions kept per user, week and language')
+        parser.add_argument('--keep-days', type=int, default=0,
+                            help='Keep all submissions of the last n days')
+        parser.add_argument('--archive', default=None,
+                            help='File the removed data is written to (default: benchmark_archive_<date>.ndjson.gz)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows read, archived and deleted at once')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+        parser.add_argument('--no-vacuum', action='store_true', help="Don't run VACUUM and ANALYZE afterwards")
+
+    def handle(self, *args, **options):
+        self.chunk_size = max(1, options['chunk_size'])
+        self.dry_run = options['dry_run']
+        keep_last = max(0, options['keep_last'])
+        keep_since = timezone.now() - timedelta(days=options['keep_days']) if options['keep_days'] else None
+        self.assignments = {assignment.id: assignment for assignment in Assignment.objects.all()}
+
+        self.removed_metrics = 0
+        self.removed_results = 0
+        self.removed_payloads = 0
+
+        archive_path = options['archive'] or f'benchmark_archive_{timezone.now():%Y%m%d_%H%M%S}.ndjson.gz'
+        self.archive = None if self.dry_run else gzip.open(archive_path, 'wt', encoding='utf-8')
+        try:
+            for rows in self.user_pages():
+                metric_ids, result_ids = self.find_superseded(rows, keep_last, keep_since)
+
+                # the page was read completely before anything is removed,
+                # sqlite doesn't allow changing a table while it is being read
+                for start in range(0, len(metric_ids), self.chunk_size):
+                    self.remove_metrics(metric_ids[start:start + self.chunk_size])
+                self.remove_results(result_ids)
+        finally:
+            if self.archive:
+                self.archive.close()
+
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f'Would remove {self.removed_metrics} metric(s) and {self.removed_results} submission(s)'
+            ))
+            return
+
+        if self.removed_metrics:
+            LeaderboardVersion.objects.update_or_create(pk=1, defaults={'benchmarks_compacted_at': timezone.now()})
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {self.removed_metrics} metric(s), {self.removed_results} submission(s) '
+            f'and {self.removed_payloads} payload(s), archived to {archive_path}'
+        ))
+        if not options['no_vacuum'] and connection.vendor == 'sqlite':
+            # gives the space of the deleted rows back and updates the statistics of the query planner
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+                cursor.execute('ANALYZE')
+            self.stdout.write('Ran VACUUM and ANALYZE')
+
+    def user_pages(self):
+        """
+        All metrics grouped by user, week and language, latest submissions first, in pages of about --chunk-size rows.
+        Pages are read by user id (keyset paging) and always contain all metrics of their users,
+        so every group and every submission is complete within one page and memory doesn't grow with the table.
+        Metrics without a week or user are skipped, `backfill_week_numbers` fills them in
+        """
+        metrics = BenchmarkMetric.objects.filter(week_number__isnull=False, user__isnull=False).order_by(
+            'user_id', 'language', 'week_number', '-benchmark_result__submission_time', '-benchmark_result_id'
+        ).values_list(
+            'id', 'user_id', 'language', 'week_number', 'cpu_time', 'assignment_id',
+            'benchmark_result_id', 'benchmark_result__submission_time'
+        )
+
+        last_user = None
+        while True:
+            page = metrics if last_user is None else metrics.filter(user_id__gt=last_user)
+            rows = list(page[:self.chunk_size])
+            if not rows:
+                return
+
+            last_user = rows[-1][1]
+            if len(rows) == self.chunk_size:
+                # the metrics of the last user may go on after the page, so they are read again completely
+                rows = [row for row in rows if row[1] != last_user] + list(metrics.filter(user_id=last_user))
+            yield rows
+
+    def find_superseded(self, rows, keep_last, keep_since):
+        """
+        Returns the ids of the metrics of a page that can be removed, and the ids of their submissions
+        """
+        leaderboard_metrics = set(
+            LeaderboardEntry.objects.filter(
+                user_id__gte=rows[0][1], user_id__lte=rows[-1][1], best_metric__isnull=False
+            ).values_list('best_metric_id', flat=True)
+        )
+
+        # the first submission that counted for an assignment, its time is the submission time of the performance
+        first_counting = {}
+        for row in rows:
+            if not assignment_has_ended(self.assignments[row[5]], at=row[7]):
+                key = (row[1], row[5])
+                if key not in first_counting or (row[7], row[6]) < first_counting[key]:
+                    first_counting[key] = (row[7], row[6])
+        first_results = {result_id for _, result_id in first_counting.values()}
+
+        metric_ids = []
+        result_ids = []
+        for _, group in groupby(rows, key=lambda row: row[1:4]):
+            group = list(group)
+
+            # latest submissions first
+            kept_results = []
+            for row in group:
+                if row[6] not in kept_results:
+                    kept_results.append(row[6])
+            kept_results = set(kept_results[:keep_last])
+
+            # the best benchmark that counts for the leaderboard, and the one the leaderboard points to
+            counting = [row for row in group if not assignment_has_ended(self.assignments[row[5]], at=row[7])]
+            if counting:
+                kept_results.add(min(counting, key=lambda row: row[4])[6])
+            kept_results.update(row[6] for row in group if row[0] in leaderboard_metrics or row[6] in first_results)
+
+            if keep_since:
+                kept_results.update(row[6] for row in group if row[7] >= keep_since)
+
+            for row in group:
+                if row[6] not in kept_results:
+                    metric_ids.append(row[0])
+                    result_ids.append(row[6])
+
+        return metric_ids, result_ids
+
+    def remove_metrics(self, ids):
+        self.removed_metrics += len(ids)
+        if self.dry_run:
+            return
+
+        with transaction.atomic():
+            rows = BenchmarkMetric.objects.filter(pk__in=ids).values(
+                'id', 'benchmark_result_id', 'benchmark_name', 'assignment_id', 'week_number', 'language', 'user_id',
+                'cpu_time', 'real_time', 'iterations'
+            )
+            for row in rows:
+                self.write_archive('metric', row)
+            BenchmarkMetric.objects.filter(pk__in=ids).delete()
+
+    def remove_results(self, result_ids):
+        """
+        Removes the submissions of which no metrics are left, then the payloads that aren't used anymore.
+        result_ids has a submission once for every metric of it that was removed
+        """
+        # all metrics of a submission are in the same page, so this is complete for the dry run
+        removed_by_result = Counter(result_ids)
+        result_ids = sorted(removed_by_result)
+
+        for start in range(0, len(result_ids), self.chunk_size):
+            chunk = result_ids[start:start + self.chunk_size]
+            results = BenchmarkResult.objects.filter(pk__in=chunk).annotate(metric_count=Count('metrics'))
+
+            if self.dry_run:
+                # the metrics are still there in a dry run, a result would be removed if all of its metrics would be
+                self.removed_results += sum(
+                    1 for pk, metric_count in results.values_list('pk', 'metric_count')
+                    if metric_count == removed_by_result[pk]
+                )
+                continue
+
+            with transaction.atomic():
+                empty = list(results.filter(metric_count=0).select_related('payload'))
+                payload_ids = {result.payload_id for result in empty if result.payload_id}
+
+                for result in empty:
+                    self.write_archive('result', {
+                        'id': result.id,
+                        'user_id': result.user_id,
+                        'language': result.language,
+                        'submission_time': result.submission_time,
+                        'raw_data': result.get_raw_data(),
+                    })
+                BenchmarkResult.objects.filter(pk__in=[result.pk for result in empty]).delete()
+                self.removed_results += len(empty)
+
+                unused = BenchmarkPayload.objects.filter(pk__in=payload_ids, results__isnull=True)
+                self.removed_payloads += unused.delete()[0]
+
+    def write_archive(self, kind, row):
+        self.archive.write(json.dumps({'type': kind, **row}, cls=DjangoJSONEncoder) + '\n')
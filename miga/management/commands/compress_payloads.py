@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from miga.models import BenchmarkPayload, BenchmarkResult
+
+"""
+Moves the benchmark JSON of results from before payloads were compressed into the payload table.
+New results are stored compressed right away, so this only has to be run once after upgrading.
+Afterwards it may be worth running `VACUUM` on the db to actually give the space back.
+"""
+class Command(BaseCommand):
+    help = 'Compress the inline benchmark JSON of older benchmark results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200, help='Number of results compressed at once')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        legacy = BenchmarkResult.objects.filter(payload__isnull=True, raw_data__isnull=False).order_by('pk')
+
+        last_pk = 0
+        compressed = 0
+        while True:
+            chunk = list(legacy.filter(pk__gt=last_pk).only('pk', 'raw_data')[:chunk_size])
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                for result in chunk:
+                    result.payload = BenchmarkPayload.store(result.raw_data)
+                    result.raw_data = None
+                BenchmarkResult.objects.bulk_update(chunk, ['payload', 'raw_data'])
+
+            compressed += len(chunk)
+            last_pk = chunk[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Compressed {compressed} result(s) into {BenchmarkPayload.objects.count()} payload(s)'
+        ))
@@ -1,5 +1,13 @@
-from django.core.management.base import BaseCommand
+import csv
+import json
+import os
+import re
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from rest_framework.authtoken.models import Token
 
 User = get_user_model()
@@ -16,36 +24,111 @@ A student can insert the token into their repo like so:
 The output can be in CSV (<username>, <token>). I added this since it might be practical to have this in case you ever want 
 to automatically send the tokens to students.
 The default output has the format "Token for <username>: <token>"
+
+For a large class, missing tokens are created with one query and the output is streamed, e.g.
+    python manage.py generate_tokens --format ndjson --output tokens.ndjson
+    python manage.py generate_tokens --csv --split-by-group --output tokens/
+With --split-by-group, --output is a directory with one file per group (the groups of the admin panel),
+students without a group end up in no_group.
 """
 class Command(BaseCommand):
     help = 'Generate API tokens for all users or a specific user'
 
     def add_arguments(self, parser):
         parser.add_argument('--username', type=str, help='Generate token for a specific user')
-        parser.add_argument('--csv', action='store_true', help='Output in CSV format')
-
+        parser.add_argument('--csv', action='store_true', help='Output in CSV format (same as --format csv)')
+        parser.add_argument('--format', choices=['text', 'csv', 'ndjson'], default='text', help='Output format')
+        parser.add_argument('--output', type=str, help='Write to this file instead of the console')
+        parser.add_argument('--split-by-group', action='store_true',
+                            help='Write one file per group into the --output directory')
 
     def handle(self, *args, **options):
         username = options.get('username')
-        csv_format = options.get('csv')
+        output_format = 'csv' if options.get('csv') else options['format']
+        output = options.get('output')
+
+        if options['split_by_group'] and not output:
+            raise CommandError('--split-by-group needs an --output directory')
 
         if username:
             try:
                 user = User.objects.get(username=username)
                 token, created = Token.objects.get_or_create(user=user)
-                self.output_token(user, token, csv_format)
+                self.output_token(user, token, output_format == 'csv')
             except User.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f'User "{username}" does not exist'))
+            return
+
+        created = self.create_missing_tokens()
+
+        if options['split_by_group']:
+            files = self.write_groups(output, output_format)
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {created} token(s), wrote {len(files)} file(s) to {output}'
+            ))
+        elif output:
+            with open(output, 'w', newline='', encoding='utf-8') as file:
+                count = self.write_tokens(file, output_format, self.user_tokens())
+            self.stdout.write(self.style.SUCCESS(f'Created {created} token(s), wrote {count} to {output}'))
         else:
-            if csv_format:
-                self.stdout.write("username,token")
+            self.write_tokens(self.stdout, output_format, self.user_tokens())
 
-            for user in User.objects.all():
-                token, created = Token.objects.get_or_create(user=user)
-                self.output_token(user, token, csv_format)
+    def create_missing_tokens(self):
+        """
+        One query for the users without a token and one insert for all of them, instead of get_or_create per user
+        """
+        with transaction.atomic():
+            missing = User.objects.filter(auth_token__isnull=True).values_list('pk', flat=True)
+            tokens = [Token(key=Token.generate_key(), user_id=user_id) for user_id in missing]
+            Token.objects.bulk_create(tokens, batch_size=500)
+        return len(tokens)
+
+    def user_tokens(self):
+        """
+        (username, token) of all users in one join, streamed so a large class doesn't have to fit in memory
+        """
+        return User.objects.order_by('username').values_list('username', 'auth_token__key').iterator(chunk_size=2000)
+
+    def write_tokens(self, file, output_format, rows):
+        if output_format == 'csv':
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(['username', 'token'])
+        count = 0
+        for username, key in rows:
+            if output_format == 'csv':
+                writer.writerow([username, key])
+            elif output_format == 'ndjson':
+                file.write(json.dumps({'username': username, 'token': key}) + '\n')
+            elif file is self.stdout:
+                file.write(self.style.SUCCESS(f'Token for {username}: {key}'))
+            else:
+                file.write(f'Token for {username}: {key}\n')
+            count += 1
+        return count
+
+    def write_groups(self, directory, output_format):
+        """
+        Sorted by group, so only the file of the current group is open and nothing is kept in memory. Students in more than one group
+        are written to each of them
+        """
+        os.makedirs(directory, exist_ok=True)
+        extension = {'text': 'txt', 'csv': 'csv', 'ndjson': 'ndjson'}[output_format]
+        rows = User.objects.order_by('groups__name', 'username').values_list(
+            'groups__name', 'username', 'auth_token__key'
+        ).iterator(chunk_size=2000)
+
+        files = []
+        for group, group_rows in groupby(rows, key=itemgetter(0)):
+            name = re.sub(r'[^\w.-]+', '_', group or 'no_group')
+            path = os.path.join(directory, f'{name}.{extension}')
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                self.write_tokens(file, output_format, ((username, key) for _, username, key in group_rows))
+            files.append(path)
+
+        return files
 
     def output_token(self, user, token, csv_format):
         if csv_format:
             self.stdout.write(f"{user.username},{token.key}")
         else:
-            self.stdout.write(self.style.SUCCESS(f'Token for {user.username}: {token.key}'))
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS(f'Token for {user.username}: {token.key}'))
@@ -0,0 +1,112 @@
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from miga.models import HiddenNameAllocator, User
+
+"""
+Creates the accounts of all students of a class from a CSV file, with their hidden usernames and API tokens:
+    python manage.py import_students students.csv
+The file needs a header. The columns are username, first_name, last_name, email and password, only username
+(or first_name and last_name) is required. Without a password, the student can't log in until one is set in the
+admin panel. Students whose username already exists are skipped, so the same file can be imported again.
+Afterwards the tokens can be exported with `generate_tokens --csv`.
+"""
+class Command(BaseCommand):
+    help = 'Create student accounts with hidden usernames and API tokens from a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='CSV file with a header: username,first_name,last_name,email,password')
+        parser.add_argument('--delimiter', default=',', help='Delimiter of the CSV file')
+        parser.add_argument('--dry-run', action='store_true', help="Only check the file, don't create anyone")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        students = self.read_students(options['csv_file'], options['delimiter'])
+
+        existing = set(User.objects.filter(
+            username__in=[student['username'] for student in students]
+        ).values_list('username', flat=True))
+        new_students = [student for student in students if student['username'] not in existing]
+
+        # all taken names are loaded once, then new names are picked in memory
+        allocator = HiddenNameAllocator(User.objects.values_list('hidden_username', flat=True))
+        users = [
+            User(
+                username=student['username'],
+                first_name=student['first_name'],
+                last_name=student['last_name'],
+                email=student['email'],
+                hidden_username=allocator.allocate(),
+                password=student['password'],
+            )
+            for student in new_students
+        ]
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Would create {len(users)} student(s), {len(existing)} already exist'
+            ))
+            return
+
+        self.hash_passwords(users)
+        prepared = time.monotonic()
+
+        # bulk_create skips User.save() and the signal that creates the token, both are done here
+        with transaction.atomic():
+            created = User.objects.bulk_create(users, batch_size=500)
+            Token.objects.bulk_create(
+                [Token(key=Token.generate_key(), user=user) for user in created],
+                batch_size=500
+            )
+
+        finished = time.monotonic()
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(created)} student(s) with tokens, skipped {len(existing)} existing '
+            f'in {finished - started:.2f}s ({prepared - started:.2f}s preparing, {finished - prepared:.2f}s writing)'
+        ))
+
+    def read_students(self, path, delimiter):
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                rows = list(csv.DictReader(file, delimiter=delimiter))
+        except OSError as error:
+            raise CommandError(f'Could not read {path}: {error}')
+
+        students = []
+        seen = set()
+        for line, row in enumerate(rows, start=2):
+            row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+            student = {
+                'first_name': row.get('first_name', ''),
+                'last_name': row.get('last_name', ''),
+                'email': row.get('email', ''),
+                'password': row.get('password', ''),
+            }
+            # same default as User.save()
+            student['username'] = row.get('username') or f"{student['first_name']}{student['last_name']}"
+
+            if not student['username']:
+                raise CommandError(f'Line {line}: a username or first and last name is needed')
+            if student['username'] in seen:
+                raise CommandError(f'Line {line}: {student["username"]} is in the file more than once')
+            seen.add(student['username'])
+            students.append(student)
+
+        return students
+
+    def hash_passwords(self, users):
+        """
+        Password hashing is slow on purpose, so it is done in parallel (the hash function releases the GIL).
+        Users without a password get an unusable one
+        """
+        def hash_password(user):
+            user.password = make_password(user.password or None)
+
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(hash_password, users))
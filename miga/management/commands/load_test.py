@@ -0,0 +1,362 @@
+import json
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from miga.cache import bump_leaderboard_version
+from miga.instrumentation import percentile
+from miga.jobs import claim_next_job, run_job
+from miga.models import BenchmarkPayload, Job, User
+from miga.ranking import LANGUAGES, WEEK_NUMBERS
+
+"""
+Measures how MIGA behaves with a whole class pushing benchmarks.
+A cohort of --users users is created, each of them pushes --submissions Google Benchmark results over the weeks of the
+semester, then everyone opens their dashboard and the scoreboard:
+    python manage.py load_test --users 100 --submissions 10 --concurrency 8 --output report.json
+By default requests go through the Django test client, so the SQL queries per request can be counted as well.
+With --url they are sent to a running server instead (which has to use the same db), then there are no query counts.
+Queued jobs are processed in between like the worker would do, unless --no-jobs is given (e.g. when a worker runs
+next to the server).
+The report has the latency percentiles, throughput and query counts per endpoint, so reports of different commits
+can be compared. The load test users are deleted at the end, unless --keep-data is given.
+Don't run this against the production db.
+"""
+class Command(BaseCommand):
+    help = 'Seed a synthetic cohort and measure the latency of the submission, dashboard and scoreboard endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='Number of users that are created')
+        parser.add_argument('--submissions', type=int, default=5, help='Number of submissions per user')
+        parser.add_argument('--page-views', type=int, default=3,
+                            help='Number of times each user opens the dashboard and the scoreboard')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of requests sent in parallel')
+        parser.add_argument('--url', default=None, help='Base url of a running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--no-jobs', action='store_true', help="Don't process the queued jobs")
+        parser.add_argument('--seed', type=int, default=None, help='Seed for the generated data')
+        parser.add_argument('--prefix', default='loadtest_', help='Prefix of the usernames of the load test users')
+        parser.add_argument('--output', default=None, help='File the JSON report is written to (default: stdout)')
+        parser.add_argument('--keep-data', action='store_true', help="Don't delete the load test users at the end")
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/') if options['url'] else None
+        self.concurrency = max(1, options['concurrency'])
+        self.random = random.Random(options['seed'])
+        self.local = threading.local()
+        prefix = options['prefix']
+
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'There already are users starting with "{prefix}", use another --prefix')
+
+        # the test client sends its requests to "testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            try:
+                report = self.run(prefix, options)
+            finally:
+                if not options['keep_data']:
+                    self.cleanup(prefix)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def run(self, prefix, options):
+        started_at = timezone.now()
+
+        users = self.create_users(prefix, options['users'])
+        self.stderr.write(f'Created {len(users)} user(s)')
+
+        submissions = [
+            (token, self.generate_submission(index, options['submissions']))
+            for index in range(options['submissions'])
+            for _, token, _ in users
+        ]
+        results = {'submit_benchmark': self.measure('submit_benchmark', submissions, self.submit)}
+
+        if not options['no_jobs']:
+            results['process_submission'] = self.process_jobs()
+
+        page_views = []
+        for _ in range(options['page_views']):
+            for user, _, session_key in users:
+                language = self.random.choice(LANGUAGES)
+                week_number = self.random.choice(WEEK_NUMBERS)
+                page_views.append(('dashboard', session_key, f"{reverse('dashboard')}?language={language}"))
+                page_views.append(('scoreboard', session_key,
+                                   f"{reverse('scoreboard')}?period=week{week_number}&language={language}"))
+        self.random.shuffle(page_views)
+
+        results.update(self.measure_pages(page_views))
+
+        return {
+            'started_at': started_at.isoformat(),
+            'commit': get_commit(),
+            'config': {
+                'users': options['users'],
+                'submissions': options['submissions'],
+                'page_views': options['page_views'],
+                'concurrency': self.concurrency,
+                'target': self.url or 'test client',
+                'db': connection.vendor,
+            },
+            'endpoints': results,
+        }
+
+    def create_users(self, prefix, count):
+        """
+        Creates the users with their tokens and a logged in session each.
+        Returns a list of (user, token, session key)
+        """
+        users = []
+        for index in range(count):
+            # set explicitly, there are not enough generated hidden names for a large cohort
+            user = User.objects.create(
+                username=f'{prefix}{index}',
+                hidden_username=f'{prefix}hidden_{index}',
+                first_name='Load',
+                last_name=f'Test {index}'
+            )
+            token, _ = Token.objects.get_or_create(user=user)
+            users.append((user, token.key, create_session(user)))
+        return users
+
+    def generate_submission(self, index, submissions):
+        """
+        A push of the index-th of all submissions of a user. Users work through the weeks over the semester
+        and get a bit faster with every push
+        """
+        current_week = min(len(WEEK_NUMBERS), 1 + index * len(WEEK_NUMBERS) // max(1, submissions))
+        language = self.random.choice(LANGUAGES)
+
+        benchmarks = []
+        for week_number in WEEK_NUMBERS:
+            if week_number > current_week:
+                break
+            for family_index, description in enumerate(('Scan', 'Join', 'Aggregate')):
+                cpu_time = self.random.lognormvariate(14, 0.6) / (1 + 0.1 * index)
+                benchmarks.append({
+                    'name': f'BM_W{week_number}_{description}',
+                    'family_index': family_index,
+                    'per_family_instance_index': 0,
+                    'run_name': f'BM_W{week_number}_{description}',
+                    'run_type': 'iteration',
+                    'repetitions': 1,
+                    'repetition_index': 0,
+                    'threads': 1,
+                    'iterations': max(1, int(1e9 / cpu_time)),
+                    'real_time': cpu_time * self.random.uniform(1.0, 1.1),
+                    'cpu_time': cpu_time,
+                    'time_unit': 'ns',
+                })
+
+        return {
+            'language': language,
+            'raw_data': {
+                'context': {
+                    'date': timezone.now().isoformat(),
+                    'host_name': 'gitlab-runner',
+                    'executable': './benchmarks',
+                    'num_cpus': 8,
+                    'mhz_per_cpu': 2400,
+                    'cpu_scaling_enabled': False,
+                    'caches': [
+                        {'type': 'Data', 'level': 1, 'size': 32768, 'num_sharing': 2},
+                        {'type': 'Unified', 'level': 2, 'size': 1048576, 'num_sharing': 2},
+                    ],
+                    'load_avg': [self.random.uniform(0, 4) for _ in range(3)],
+                    'library_build_type': 'release',
+                },
+                'benchmarks': benchmarks,
+            },
+        }
+
+    def submit(self, request):
+        token, body = request
+        return self.request('POST', reverse('submit_benchmark'), body=body, token=token)
+
+    def measure_pages(self, page_views):
+        """
+        Page views are sent mixed, like they would be in class, and reported per endpoint
+        """
+        timings = {}
+        started = time.monotonic()
+        for name, timing in self.map(lambda view: (view[0], self.request('GET', view[2], session_key=view[1])), page_views):
+            timings.setdefault(name, []).append(timing)
+        duration = time.monotonic() - started
+
+        return {name: summarize(endpoint_timings, duration) for name, endpoint_timings in timings.items()}
+
+    def measure(self, name, requests, send):
+        started = time.monotonic()
+        timings = list(self.map(send, requests))
+        self.stderr.write(f'Sent {len(timings)} {name} request(s)')
+        return summarize(timings, time.monotonic() - started)
+
+    def map(self, func, items):
+        def call(item):
+            try:
+                return func(item)
+            finally:
+                # every thread of the pool has its own connection, which has to be closed before the thread is gone
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            yield from executor.map(call, items)
+
+    def process_jobs(self):
+        """
+        Works through the job queue like run_miga_worker, with the same number of threads as the requests
+        """
+        def work(_):
+            timings = []
+            try:
+                while True:
+                    job = claim_next_job()
+                    if job is None:
+                        return timings
+
+                    started = time.monotonic()
+                    with CaptureQueriesContext(connection) as queries:
+                        job = run_job(job)
+                    timings.append((time.monotonic() - started, len(queries), 200 if job.status == Job.DONE else 500))
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            timings = [timing for worker in executor.map(work, range(self.concurrency)) for timing in worker]
+        self.stderr.write(f'Processed {len(timings)} job(s)')
+        return summarize(timings, time.monotonic() - started)
+
+    def request(self, method, path, body=None, token=None, session_key=None):
+        """
+        Sends a request and returns (seconds, number of queries or None, status code)
+        """
+        if self.url:
+            return self.http_request(method, path, body, token, session_key)
+
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client()
+
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        if session_key:
+            client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+
+        started = time.monotonic()
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'POST':
+                response = client.post(path, body, content_type='application/json', **headers)
+            else:
+                response = client.get(path, **headers)
+            # streaming responses are only done once they are consumed
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+        return time.monotonic() - started, len(queries), response.status_code
+
+    def http_request(self, method, path, body, token, session_key):
+        headers = {}
+        data = None
+        if token:
+            headers['Authorization'] = f'Token {token}'
+        if session_key:
+            headers['Cookie'] = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        request = urllib.request.Request(self.url + path, data=data, headers=headers, method=method)
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except urllib.error.URLError:
+            status = 0
+
+        return time.monotonic() - started, None, status
+
+    def cleanup(self, prefix):
+        User.objects.filter(username__startswith=prefix).delete()
+        # payloads are shared between results, the ones of the load test users aren't used anymore now
+        BenchmarkPayload.objects.filter(results__isnull=True).delete()
+        bump_leaderboard_version()
+        self.stderr.write('Deleted the load test users')
+
+
+def create_session(user):
+    """
+    A logged in session, so page views don't have to go through the login form
+    """
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return session.session_key
+
+
+def summarize(timings, duration):
+    """
+    Latencies (in ms), throughput and query counts of a list of (seconds, queries, status code)
+    """
+    latencies = sorted(seconds * 1000 for seconds, _, _ in timings)
+    queries = sorted(count for _, count, _ in timings if count is not None)
+
+    status_codes = {}
+    for _, _, status in timings:
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+
+    return {
+        'requests': len(timings),
+        'errors': sum(1 for _, _, status in timings if not 200 <= status < 400),
+        'status_codes': status_codes,
+        'throughput_per_second': round(len(timings) / duration, 2) if duration else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'p50': round(percentile(latencies, 50), 2) if latencies else None,
+            'p95': round(percentile(latencies, 95), 2) if latencies else None,
+            'p99': round(percentile(latencies, 99), 2) if latencies else None,
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2),
+            'p95': percentile(queries, 95),
+            'max': queries[-1],
+        } if queries else None,
+    }
+
+
+def get_commit():
+    """
+    the git commit the report was made on, so reports can be compared
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,129 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from miga.awards import REPLAYABLE_AWARDS, get_award_catalog, replay_awards
+from miga.db import dry_run_atomic
+from miga.events import AwardRevoked, publish
+from miga.models import LeaderboardVersion, UserAward
+from miga.replay import BenchmarkReplay
+
+"""
+Replays all stored benchmarks in the order they were submitted and rebuilds everything derived from them:
+performances, the totals of users, the leaderboard with total scores and rank snapshots, and the awards that only depend
+on submission times, deadlines and who took first place with a push (Early Bird, Night Owl, Weekend Warrior,
+Timely Toucan, Punctual Peacock, High Score Horse).
+Run it after changing one of these award rules, fixing the end date of an assignment or restoring a backup:
+    python manage.py rebuild_derived --dry-run
+    python manage.py rebuild_derived --revoke --workers 4
+The metrics are streamed, so memory only grows with the number of users and assignments, not with the number of pushes.
+Awards are only given out, unless --revoke is set. After `compact_benchmarks`, --revoke only takes away
+Punctual Peacock and Timely Toucan, the other awards were earned with single pushes that may have been deleted.
+Performances without any benchmarks (e.g. added in the admin panel) are kept. Awards that depend on ranks are not
+replayed, they are checked again on the next push.
+"""
+class Command(BaseCommand):
+    help = 'Replay all stored benchmarks and rebuild performances, totals, the leaderboard and time based awards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of metrics read from the db at once')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Evaluate the awards per user in this many processes (default: in this process)')
+        parser.add_argument('--revoke', action='store_true', help='Remove replayable awards that are not earned anymore')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.revocable = self.revocable_awards(options['revoke'])
+        self.replay = BenchmarkReplay(options['chunk_size'], awards=True).run()
+        replayed = time.monotonic()
+
+        created, updated, deleted = self.replay.plan_performances()
+        earned = self.evaluate_awards(options['workers'])
+
+        with dry_run_atomic(options['dry_run']):
+            self.replay.write_performances(created, updated, deleted)
+            users = self.replay.write_user_totals()
+            entries = self.replay.write_leaderboard()
+            granted, revoked = self.write_awards(earned, options['revoke'])
+
+        prefix = 'Would rebuild' if options['dry_run'] else 'Rebuilt'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} from {self.replay.metric_count} metrics in {time.monotonic() - started:.2f}s '
+            f'({replayed - started:.2f}s replaying): {len(created)} new, {len(updated)} changed and '
+            f'{len(deleted)} removed performance(s), totals of {users} user(s), {entries} leaderboard entries, '
+            f'{granted} new and {revoked} revoked award(s)'
+        ))
+
+    def revocable_awards(self, revoke):
+        """
+        Names of the replayable awards that are revoked if they aren't earned anymore. Once compact_benchmarks deleted
+        pushes, the replay doesn't see every push anymore, so only the awards that depend on the performances are checked
+        """
+        revocable = {rule.name for rule in REPLAYABLE_AWARDS}
+        compacted_at = LeaderboardVersion.objects.filter(pk=1).values_list(
+            'benchmarks_compacted_at', flat=True
+        ).first()
+        if not compacted_at:
+            return revocable
+
+        per_push = sorted(rule.name for rule in REPLAYABLE_AWARDS if 'performances' not in rule.requires)
+        if revoke:
+            self.stdout.write(self.style.WARNING(
+                f'Benchmarks were compacted on {compacted_at:%Y-%m-%d}, {", ".join(per_push)} are not revoked'
+            ))
+        return revocable - set(per_push)
+
+    def evaluate_awards(self, workers):
+        """
+        user_id -> names of the replayable awards the user earned. Awards that depend on the performances can only be
+        evaluated once the replay is done, this is done per user, optionally in other processes
+        """
+        user_performances = self.replay.user_performances
+        user_ids = list(user_performances)
+        if workers > 0:
+            # the children don't use the db, they only need the app registry to unpickle the performances
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+                results = executor.map(replay_awards, user_performances.values(), chunksize=100)
+                performance_awards = dict(zip(user_ids, results))
+        else:
+            performance_awards = {user_id: replay_awards(user_performances[user_id]) for user_id in user_ids}
+
+        return {
+            user_id: self.replay.submission_awards.get(user_id, set()) | performance_awards.get(user_id, set())
+            for user_id in set(self.replay.submission_awards) | set(performance_awards)
+        }
+
+    def write_awards(self, earned, revoke):
+        awards = get_award_catalog()
+        replayable = {rule.name: awards[rule.name] for rule in REPLAYABLE_AWARDS if rule.name in awards}
+
+        held = set(
+            UserAward.objects.filter(award__in=replayable.values()).values_list('user_id', 'award__name')
+        )
+        deserved = {(user_id, name) for user_id, names in earned.items() for name in names if name in replayable}
+
+        new_awards = deserved - held
+        UserAward.objects.bulk_create(
+            [UserAward(user_id=user_id, award=replayable[name]) for user_id, name in new_awards],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+
+        revoked = {(user_id, name) for user_id, name in held - deserved if name in self.revocable} if revoke else set()
+        for name in replayable:
+            user_ids = [user_id for user_id, award_name in revoked if award_name == name]
+            if user_ids:
+                UserAward.objects.filter(award=replayable[name], user_id__in=user_ids).delete()
+
+        def publish_revoked():
+            for user_id, name in sorted(revoked):
+                publish(AwardRevoked(user_id, name))
+
+        # not published for a dry run, which is rolled back
+        transaction.on_commit(publish_revoked)
+
+        return len(new_awards), len(revoked)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from miga.replay import rebuild_leaderboard
+
+"""
+Rebuilds the leaderboard (best time per user, week and language) and the rank snapshots from all stored benchmark metrics.
+New submissions update the leaderboard on their own, so this only has to be run once after upgrading,
+or if benchmark data was changed by hand. The benchmarks are replayed like in `rebuild_derived`, which also
+rebuilds performances and awards.
+"""
+class Command(BaseCommand):
+    help = 'Rebuild the leaderboard from all stored benchmark metrics'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_leaderboard()
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} leaderboard entries'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from miga.db import dry_run_atomic
+from miga.replay import BenchmarkReplay
+
+"""
+Performances and the totals of users are updated with the difference whenever a faster benchmark comes in,
+instead of being recomputed every time. This recomputes them from the stored benchmarks and fixes anything that
+drifted, e.g. after rows were changed or deleted by hand in the admin panel:
+    python manage.py reconcile_aggregates --dry-run
+The benchmarks are replayed like in `rebuild_derived`, but the leaderboard and the awards are left as they are.
+Performances without any benchmarks (e.g. added in the admin panel) are kept.
+"""
+class Command(BaseCommand):
+    help = "Recompute performances and user totals from the stored benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of metrics read from the db at once')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what is out of sync')
+
+    def handle(self, *args, **options):
+        replay = BenchmarkReplay(options['chunk_size']).run()
+        created, updated, deleted = replay.plan_performances()
+
+        with dry_run_atomic(options['dry_run']):
+            replay.write_performances(created, updated, deleted)
+            users = replay.write_user_totals()
+
+        prefix = 'Would fix' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} {len(created)} missing, {len(updated)} wrong and {len(deleted)} outdated performance(s), '
+            f'and the totals of {users} user(s)'
+        ))
@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from miga.db import retry_on_lock
+from miga.jobs import claim_next_job, run_job
+from miga.leaderboard import close_ended_assignments
+from miga.models import Job
+
+"""
+Works through the job queue, e.g. the ranking and award updates after a benchmark was pushed.
+This should always run next to the web server, otherwise awards are only given out when the worker is started again:
+    python manage.py run_miga_worker --threads 2
+With --once, all pending jobs are processed and the command exits (e.g. for a cron job).
+While idle, the worker also freezes the rank snapshots of assignments whose end date has passed.
+"""
+class Command(BaseCommand):
+    help = 'Process queued jobs (rankings and awards after benchmark submissions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Number of jobs processed in parallel')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Process all pending jobs, then exit')
+        parser.add_argument('--requeue-running', action='store_true',
+                            help='Put jobs that are still marked as running (e.g. after a crash) back into the queue')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        poll_interval = options['poll_interval']
+        once = options['once']
+
+        if options['requeue_running']:
+            requeued = Job.objects.filter(status=Job.RUNNING).update(status=Job.PENDING, started_at=None)
+            self.stdout.write(f'Requeued {requeued} job(s)')
+
+        stop = threading.Event()
+        self.stdout.write(f'Worker started with {threads} thread(s)')
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # the first thread also closes assignments that have ended while it has nothing else to do
+            futures = [executor.submit(self.work, stop, poll_interval, once, index == 0) for index in range(threads)]
+            try:
+                processed = sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                stop.set()
+                processed = sum(future.result() for future in futures)
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
+
+    def work(self, stop, poll_interval, once, closes_assignments=False):
+        processed = 0
+        next_close = 0
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                job = retry_on_lock(claim_next_job)
+
+                if job is None:
+                    if closes_assignments and time.monotonic() >= next_close:
+                        closed = retry_on_lock(close_ended_assignments)
+                        if closed:
+                            self.stdout.write(f'Froze the ranks of week(s) {", ".join(map(str, closed))}')
+                        next_close = time.monotonic() + 60
+                    if once:
+                        break
+                    stop.wait(poll_interval)
+                    continue
+
+                started = time.monotonic()
+                job = run_job(job)
+                processed += 1
+
+                if job.status == Job.FAILED:
+                    self.stderr.write(f'{job} failed:\n{job.error}')
+                else:
+                    self.stdout.write(f'{job} finished in {time.monotonic() - started:.2f}s')
+        finally:
+            connections.close_all()
+
+        return processed
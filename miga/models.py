@@ -1,4 +1,9 @@
+import hashlib
+import json
 import random
+import re
+import secrets
+import zlib
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
@@ -8,6 +13,29 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
+# benchmarks are called BM_W<number> or BM_W<number>_<description>
+BENCHMARK_WEEK_PATTERN = re.compile(r'^BM_W(\d+)(?:_|$)')
+
+
+def parse_week_number(benchmark_name):
+    """
+    Week number of a benchmark, or None if the name doesn't belong to a week
+    """
+    week_match = BENCHMARK_WEEK_PATTERN.match(benchmark_name or '')
+    return int(week_match.group(1)) if week_match else None
+
+
+# hidden usernames are made of an adjective and an animal, e.g. "JollyPanda"
+HIDDEN_NAME_ADJECTIVES = [
+    "Supportive", "Frantic", "Beautiful", "Chaotic", "Chubby", "Bald", "Clean", "Elegant", "Scruffy", "Unkempt",
+    "Agreeable", "Ambitious", "Jolly", "Witty", "Clumsy", "Thoughtless", "Chatty", "Gothic", "Mischievous", "Cautious"
+]
+HIDDEN_NAME_ANIMALS = [
+    "Cow", "Gorilla", "Antelope", "Bat", "Whale", "Butterfly", "Goldfish", "Crocodile", "Lion", "Sheep", "Turtle",
+    "Panda", "Ladybug", "Chicken", "Hippo", "Wolf", "Grasshopper", "Crab", "Jellyfish", "Moose", "Elephant", "Giraffe"
+]
+
+
 class User(AbstractUser):
     hidden_username = models.CharField(max_length=50, unique=True)
     use_hidden_username = models.BooleanField(default=False)
@@ -37,44 +65,42 @@ class User(AbstractUser):
 
     def _generate_unique_hidden_username(self):
         """
-        Generate a unique hidden username
+        Generate a unique hidden username. The taken names are loaded with one query
         """
-        adjectives = ["Supportive", "Frantic", "Beautiful", "Chaotic", "Chubby", "Bald", "Clean", "Elegant", "Scruffy",
-                      "Unkempt", "Agreeable", "Ambitious", "Jolly", "Witty", "Clumsy", "Thoughtless", "Chatty", "Gothic",
-                      "Mischievous", "Cautious"]
-        animals = ["Cow", "Gorilla", "Antelope", "Bat", "Whale", "Butterfly", "Goldfish", "Crocodile", "Lion", "Sheep",
-                   "Turtle", "Panda", "Ladybug", "Chicken", "Hippo", "Wolf", "Grasshopper", "Crab", "Jellyfish", "Moose",
-                   "Elephant", "Giraffe"]
-
-        # since they are randomly generated, it may take a few tries to find name that isnt used yet.
-        # for current class size, it should usually work in 1 try, 2 at most. i put 100 just to be sure
-        attempts = 0
-        max_attempts = 100
-
-        while attempts < max_attempts:
-            adjective = random.choice(adjectives)
-            animal = random.choice(animals)
-
-            hidden_username = f"{adjective}{animal}"
-
-            # check if this combination already exists
-            if not User.objects.filter(hidden_username=hidden_username).exists():
+        taken = User.objects.values_list('hidden_username', flat=True)
+        return HiddenNameAllocator(taken).allocate()
+
+
+class HiddenNameAllocator:
+    """
+    Hands out hidden usernames that aren't taken yet, without asking the db for every name.
+    Names are drawn from all adjective/animal combinations in random order. Once they are used up
+    (there are only 440), a random number is appended
+    """
+    def __init__(self, taken=()):
+        self.taken = set(taken)
+        pool = [f"{adjective}{animal}" for adjective in HIDDEN_NAME_ADJECTIVES for animal in HIDDEN_NAME_ANIMALS]
+        random.shuffle(pool)
+        self._pool = iter(pool)
+
+    def allocate(self):
+        for hidden_username in self._pool:
+            if hidden_username not in self.taken:
+                self.taken.add(hidden_username)
                 return hidden_username
 
-            attempts += 1
-
-        # If we couldn't find a unique combination after max_attempts, we append a random number
-        # this will probably never happen.
         while True:
-            adjective = random.choice(adjectives)
-            animal = random.choice(animals)
+            adjective = random.choice(HIDDEN_NAME_ADJECTIVES)
+            animal = random.choice(HIDDEN_NAME_ANIMALS)
             random_number = random.randint(1, 9999)
 
             hidden_username = f"{adjective}{animal}{random_number}"
 
-            if not User.objects.filter(hidden_username=hidden_username).exists():
+            if hidden_username not in self.taken:
+                self.taken.add(hidden_username)
                 return hidden_username
 
+
 class Assignment(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
@@ -96,20 +122,57 @@ class Performance(models.Model):
         ordering = ['-submission_time']
         unique_together = ['user', 'assignment']  # One submission per assignment per user. old submissions discarded when new ones are pushed
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered, so saving only has to add the difference to the user's total
+        instance._loaded_score = instance.score if 'score' in field_names else None
+        return instance
+
     def save(self, *args, **kwargs):
+        created = self._state.adding
+        loaded_score = getattr(self, '_loaded_score', None)
         super().save(*args, **kwargs)
-        user = self.user
-
-        user.total_score = Performance.objects.filter(user=user).aggregate(
-            total=models.Sum('score'))['total'] or 0
-
-        user.assignments_completed = Performance.objects.filter(user=user).count()
 
-        user.save()
+        # the user's totals are updated by the db with the difference, instead of adding up all performances again.
+        # `manage.py reconcile_aggregates` recomputes them if they ever drift
+        score = int(self.score)
+        if created:
+            User.objects.filter(pk=self.user_id).update(
+                total_score=models.F('total_score') + score,
+                assignments_completed=models.F('assignments_completed') + 1
+            )
+        elif loaded_score is None:
+            update_user_totals(self.user_id)
+        elif score != loaded_score:
+            User.objects.filter(pk=self.user_id).update(total_score=models.F('total_score') + score - loaded_score)
+        self._loaded_score = score
+
+    def delete(self, *args, **kwargs):
+        score = getattr(self, '_loaded_score', None)
+        user_id = self.user_id
+        result = super().delete(*args, **kwargs)
+
+        if score is None:
+            update_user_totals(user_id)
+        else:
+            User.objects.filter(pk=user_id).update(
+                total_score=models.F('total_score') - score,
+                assignments_completed=models.F('assignments_completed') - 1
+            )
+        return result
 
     def __str__(self):
         return f"{self.user.username} - {self.assignment.name} ({self.score} points)"
 
+def update_user_totals(user_id):
+    """
+    Recomputes a user's total score and number of completed assignments from their performances
+    """
+    totals = Performance.objects.filter(user_id=user_id).aggregate(total=models.Sum('score'), completed=models.Count('id'))
+    User.objects.filter(pk=user_id).update(total_score=totals['total'] or 0, assignments_completed=totals['completed'])
+
+
 # Auto-create tokens for users
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
@@ -117,6 +180,33 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+class BenchmarkPayload(models.Model):
+    """
+    Full benchmark JSON of a submission, compressed.
+    Payloads are stored by their hash, so identical payloads (e.g. retried CI jobs) are only stored once.
+    They live in their own table, so loading benchmark results doesn't load them
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def store(cls, raw_data):
+        encoded = json.dumps(raw_data, sort_keys=True, separators=(',', ':')).encode()
+        payload, _ = cls.objects.get_or_create(
+            sha256=hashlib.sha256(encoded).hexdigest(),
+            defaults={'data': zlib.compress(encoded, 6), 'size': len(encoded)}
+        )
+        return payload
+
+    def load(self):
+        return json.loads(zlib.decompress(self.data))
+
+    def __str__(self):
+        return f"Payload {self.sha256[:12]} ({self.size} bytes)"
+
+
 class BenchmarkResult(models.Model):
     LANGUAGE_CHOICES = [
         ('cpp', 'C++'),
@@ -125,12 +215,23 @@ class BenchmarkResult(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     submission_time = models.DateTimeField(auto_now_add=True)
-    raw_data = models.JSONField()  # Stores full benchmark JSON
+    # Stores full benchmark JSON, compressed. Use get_raw_data() to read it
+    payload = models.ForeignKey(BenchmarkPayload, on_delete=models.PROTECT, null=True, blank=True, related_name='results')
+    # results from before payloads were compressed, moved to payload by `manage.py compress_payloads`
+    raw_data = models.JSONField(null=True, blank=True)
     language = models.CharField(max_length=10, choices=LANGUAGE_CHOICES, default='cpp')
 
     def __str__(self):
         return f"{self.user.username} benchmark result from {self.submission_time}"
 
+    def get_raw_data(self):
+        """
+        the payload is only loaded and decompressed here
+        """
+        if self.payload_id:
+            return self.payload.load()
+        return self.raw_data
+
 
 class Award(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -165,21 +266,31 @@ class BenchmarkMetric(models.Model):
     cpu_time = models.FloatField()
     real_time = models.FloatField()
     iterations = models.IntegerField()
+    # parsed from the name and copied from the benchmark result once when the metric is stored, so rankings can use indexes.
+    # older metrics are filled in by `manage.py backfill_week_numbers`
+    week_number = models.PositiveSmallIntegerField(null=True, blank=True)
+    language = models.CharField(max_length=10, choices=BenchmarkResult.LANGUAGE_CHOICES, default='cpp')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='benchmark_metrics')
 
     class Meta:
         unique_together = ['benchmark_result', 'benchmark_name']
+        indexes = [
+            models.Index(fields=['language', 'week_number', 'cpu_time'], name='metric_week_rank_idx'),
+            models.Index(fields=['user', 'week_number'], name='metric_user_week_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        self.language = self.benchmark_result.language
+        self.user_id = self.benchmark_result.user_id
+
         # gets week number
-        import re
-        week_match = re.search(r'W(\d+)', self.benchmark_name)
-        if week_match:
-            week_number = int(week_match.group(1))
-            assignment_name = f"Week {week_number}"
+        self.week_number = parse_week_number(self.benchmark_name)
+        if self.week_number:
+            assignment_name = f"Week {self.week_number}"
 
             self.assignment, _ = Assignment.objects.get_or_create(
                 name=assignment_name,
-                defaults={'description': f'Assignment for Week {week_number}'}
+                defaults={'description': f'Assignment for Week {self.week_number}'}
             )
 
         super().save(*args, **kwargs)
@@ -187,25 +298,146 @@ class BenchmarkMetric(models.Model):
         self.update_performance()
 
     def update_performance(self):
-        # Check if assignment has an end date and if it has passed
-        if self.assignment.end_date and self.assignment.end_date < timezone.now():
+        # Check if assignment has an end date and if it had passed when this was submitted
+        if self.assignment.end_date and self.assignment.end_date < self.benchmark_result.submission_time:
             # Assignment has ended, don't update benchmarks
             # this is especially necessary, for weeks 5 and 6
             return
 
         performance, created = Performance.objects.get_or_create(
-            user=self.benchmark_result.user,
+            user_id=self.benchmark_result.user_id,
             assignment=self.assignment,
-            defaults={'score': 0, 'completion_time': 0, 'cpu_time': self.cpu_time}
+            defaults={'score': self.cpu_time, 'completion_time': 0, 'cpu_time': self.cpu_time}
         )
 
-        metric = BenchmarkMetric.objects.filter(
-            assignment=self.assignment,
-            benchmark_name=self.benchmark_name
-        ).order_by('cpu_time')
-
-        if metric:
-            time = metric.first().cpu_time
-            performance.score = time
-            performance.cpu_time = time
+        # running minimum: the performance already has the best time so far, so only this metric has to be compared
+        if not created and (performance.cpu_time is None or self.cpu_time < performance.cpu_time):
+            performance.score = self.cpu_time
+            performance.cpu_time = self.cpu_time
             performance.save()
+
+
+class LeaderboardEntry(models.Model):
+    """
+    Best cpu time per user, week and language.
+    This is kept up to date when benchmarks are submitted, so rankings can be read with one query
+    instead of going through the metrics of every user.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    week_number = models.PositiveSmallIntegerField()
+    language = models.CharField(max_length=10, choices=BenchmarkResult.LANGUAGE_CHOICES, default='cpp')
+    best_cpu_time = models.FloatField(help_text="CPU time in nanoseconds")
+    best_metric = models.ForeignKey(BenchmarkMetric, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'week_number', 'language']
+        indexes = [
+            models.Index(fields=['week_number', 'language', 'best_cpu_time'], name='leaderboard_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - Week {self.week_number} ({self.language}): {self.best_cpu_time}"
+
+
+class Job(models.Model):
+    """
+    Work that is done after a request has been answered, e.g. rankings and awards after a benchmark was submitted.
+    Jobs are picked up by `manage.py run_miga_worker`
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class TotalScore(models.Model):
+    """
+    Total score of a user for one language, summed over the best times of all weeks.
+    Stored so the overall rank is a single count of users with a higher score
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='total_scores')
+    language = models.CharField(max_length=10, choices=BenchmarkResult.LANGUAGE_CHOICES, default='cpp')
+    score = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'language']
+        indexes = [
+            models.Index(fields=['language', 'score'], name='total_score_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} ({self.language}): {self.score}"
+
+
+class RankSnapshot(models.Model):
+    """
+    Rank of a user in a week and language. Written whenever the leaderboard of that week changes,
+    and frozen (final) once the assignment of the week has ended.
+    Rank histories for the dashboard and the awards are read from here instead of ranking every week again
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rank_snapshots')
+    week_number = models.PositiveSmallIntegerField()
+    language = models.CharField(max_length=10, choices=BenchmarkResult.LANGUAGE_CHOICES, default='cpp')
+    rank = models.PositiveIntegerField()
+    # rank before the last change, for the rank change shown on the scoreboard
+    previous_rank = models.PositiveIntegerField(null=True, blank=True)
+    final = models.BooleanField(default=False, help_text="The assignment has ended, the rank doesn't change anymore")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['user', 'week_number', 'language']
+        indexes = [
+            models.Index(fields=['user', 'language'], name='rank_snapshot_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - Week {self.week_number} ({self.language}): #{self.rank}"
+
+
+def new_version_token():
+    return secrets.token_hex(8)
+
+
+class LeaderboardVersion(models.Model):
+    """
+    Single row that is bumped whenever data shown on the dashboard or scoreboard changes.
+    Cached pages contain the version in their key, so bumping it invalidates all of them at once
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    # changed together with the version. The cache outlives the db, this way pages cached for another db
+    # (before it was reset, re-created or restored from a backup) never match
+    token = models.CharField(max_length=32, default=new_version_token)
+    # bumped whenever awards are added, changed or deleted, so every process reloads its award catalog
+    award_catalog_version = models.PositiveBigIntegerField(default=0)
+    # set by `manage.py compact_benchmarks`. Pushes were deleted, so awards earned with a single push can't be
+    # checked again afterwards (see `manage.py rebuild_derived --revoke`)
+    benchmarks_compacted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Leaderboard version {self.version}"
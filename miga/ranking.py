@@ -0,0 +1,196 @@
+from django.db.models import Count, F, OuterRef, Prefetch, Q, Subquery, Window
+from django.db.models.functions import Rank
+
+from .models import LeaderboardEntry, RankSnapshot, UserAward
+
+# there are 6 assignments, one per week
+WEEK_NUMBERS = range(1, 7)
+LANGUAGES = ['cpp', 'rust']
+
+
+def ranked_entries(languages=None):
+    """
+    Leaderboard entries annotated with their rank.
+    The rank is computed by the database with RANK() OVER (PARTITION BY week, language ORDER BY best cpu time),
+    so users with the same time share a rank.
+    """
+    languages = languages or LANGUAGES
+    return LeaderboardEntry.objects.filter(
+        language__in=languages,
+        week_number__in=WEEK_NUMBERS
+    ).annotate(
+        rank=Window(
+            expression=Rank(),
+            partition_by=[F('week_number'), F('language')],
+            order_by=F('best_cpu_time').asc()
+        )
+    )
+
+
+def get_user_ranks(user, language='cpp'):
+    """
+    The user's rank for every week, None for weeks without a submission.
+    Read from the rank snapshots, which are updated whenever the leaderboard changes (see leaderboard.py)
+    """
+    ranks = dict(RankSnapshot.objects.filter(user=user, language=language).values_list('week_number', 'rank'))
+    return [ranks.get(week) for week in WEEK_NUMBERS]
+
+
+# number of users per scoreboard page, and users shown above and below the user in the "around me" view
+SCOREBOARD_PAGE_SIZE = 10
+AROUND_ME = 5
+
+
+def scoreboard_entries(week_number, language):
+    """
+    Leaderboard entries of a week in scoreboard order (fastest first, ties by user id), with the user, the awards and
+    the rank before the last change. Awards are prefetched, so they are only loaded for the rows that are shown
+    """
+    previous_rank = RankSnapshot.objects.filter(
+        user=OuterRef('user'),
+        week_number=OuterRef('week_number'),
+        language=OuterRef('language')
+    ).values('previous_rank')[:1]
+
+    return LeaderboardEntry.objects.filter(
+        week_number=week_number,
+        language=language
+    ).select_related('user').prefetch_related(
+        Prefetch('user__awards', queryset=UserAward.objects.select_related('award').order_by('pk'))
+    ).annotate(previous_rank=Subquery(previous_rank)).order_by('best_cpu_time', 'user_id')
+
+
+def entries_after(entries, cpu_time, user_id):
+    return entries.filter(Q(best_cpu_time__gt=cpu_time) | Q(best_cpu_time=cpu_time, user_id__gt=user_id))
+
+
+def entries_before(entries, cpu_time, user_id):
+    return entries.filter(Q(best_cpu_time__lt=cpu_time) | Q(best_cpu_time=cpu_time, user_id__lt=user_id))
+
+
+def encode_cursor(entry):
+    return f"{entry.best_cpu_time!r}:{entry.user_id}"
+
+
+def decode_cursor(cursor):
+    """
+    (cpu time, user id) of the last row of the previous page, None if the cursor is invalid
+    """
+    try:
+        cpu_time, user_id = cursor.rsplit(':', 1)
+        return float(cpu_time), int(user_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def rank_rows(week_number, language, entries):
+    """
+    Scoreboard rows for consecutive entries. Only the position of the first entry is counted by the db (with the
+    index), the ranks of the others follow from it. Users with the same time share a rank
+    """
+    if not entries:
+        return []
+
+    first = entries[0]
+    counts = LeaderboardEntry.objects.filter(week_number=week_number, language=language).aggregate(
+        faster=Count('pk', filter=Q(best_cpu_time__lt=first.best_cpu_time)),
+        before=Count('pk', filter=Q(best_cpu_time__lt=first.best_cpu_time) | Q(
+            best_cpu_time=first.best_cpu_time, user_id__lt=first.user_id))
+    )
+
+    rows = []
+    rank = counts['faster'] + 1
+    for index, entry in enumerate(entries):
+        if index and entry.best_cpu_time != entries[index - 1].best_cpu_time:
+            rank = counts['before'] + index + 1
+
+        user = entry.user
+        rows.append({
+            'id': user.id,
+            'display_name': user.display_name,
+            'rank': rank,
+            'cpu_time': entry.best_cpu_time,
+            # positive if the user moved up
+            'rank_change': entry.previous_rank - rank if entry.previous_rank else 0,
+            'awards': [
+                {
+                    'name': user_award.award.name,
+                    'description': user_award.award.description,
+                    'image_name': user_award.award.image_name,
+                }
+                for user_award in user.awards.all()
+            ],
+        })
+    return rows
+
+
+def get_scoreboard(week_number, language, limit=SCOREBOARD_PAGE_SIZE, after=None):
+    """
+    One page of the scoreboard of a week, starting after the cursor of the previous page (keyset pagination),
+    so a page costs the same no matter how many users there are.
+    Plain dicts, so the result can be cached for all users until the leaderboard changes
+    """
+    entries = scoreboard_entries(week_number, language)
+    cursor = decode_cursor(after) if after else None
+    if cursor:
+        entries = entries_after(entries, *cursor)
+
+    # one more than shown, to know if there is a next page
+    page = list(entries[:limit + 1])
+    has_next = len(page) > limit
+    page = page[:limit]
+
+    return {
+        'rows': rank_rows(week_number, language, page),
+        'next_cursor': encode_cursor(page[-1]) if has_next else None,
+    }
+
+
+def get_scoreboard_around(user, week_number, language, around=AROUND_ME):
+    """
+    The user's row with `around` rows above and below it. Empty if the user has no time in this week
+    """
+    entries = scoreboard_entries(week_number, language)
+    own = LeaderboardEntry.objects.filter(user=user, week_number=week_number, language=language).first()
+    if own is None:
+        return {'rows': [], 'next_cursor': None}
+
+    above = list(entries_before(entries, own.best_cpu_time, own.user_id).reverse()[:around])[::-1]
+    below = list(entries.filter(
+        Q(best_cpu_time__gt=own.best_cpu_time) | Q(best_cpu_time=own.best_cpu_time, user_id__gte=own.user_id)
+    )[:around + 2])
+
+    has_next = len(below) > around + 1
+    page = above + below[:around + 1]
+
+    return {
+        'rows': rank_rows(week_number, language, page),
+        'next_cursor': encode_cursor(page[-1]) if has_next else None,
+    }
+
+
+def get_user_week_rank(user, week_number, language):
+    """
+    The user's rank in a week, None without a submission
+    """
+    return RankSnapshot.objects.filter(
+        user=user, week_number=week_number, language=language
+    ).values_list('rank', flat=True).first()
+
+
+def get_week_ranks(week_number, language):
+    """
+    Ranks of all users in a week as {user_id: rank}, for the live scoreboard
+    """
+    return dict(RankSnapshot.objects.filter(week_number=week_number, language=language).values_list('user_id', 'rank'))
+
+
+def get_live_board(week_number, language):
+    """
+    The first page of the scoreboard and the ranks of all users, so every client of the live scoreboard
+    can show its own rank
+    """
+    return {
+        'rows': get_scoreboard(week_number, language)['rows'],
+        'ranks': get_week_ranks(week_number, language),
+    }
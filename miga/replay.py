@@ -0,0 +1,159 @@
+"""
+Everything derived from the stored benchmarks (performances, the totals of users, the leaderboard) is recomputed
+by replaying them in the order they were pushed, the same way ingest_submission handles a push.
+Used by `rebuild_derived`, `reconcile_aggregates` and `rebuild_leaderboard`, so they all agree on the result.
+"""
+from datetime import timedelta
+
+from .awards import replay_awards
+from .leaderboard import assignment_has_ended, write_leaderboard
+from .models import Assignment, BenchmarkMetric, Performance, User
+
+
+class BenchmarkReplay:
+    """
+    One pass over all metrics, oldest submission first. Only the best time so far is kept per user and assignment,
+    and per user, week and language, so equal times keep the first submission like they do on a push.
+    With awards, the awards earned with a single push are collected as well (see replay_awards)
+    """
+    def __init__(self, chunk_size=2000, awards=False):
+        self.chunk_size = max(1, chunk_size)
+        self.awards = awards
+        self.assignments = {assignment.id: assignment for assignment in Assignment.objects.all()}
+
+        # (user_id, assignment_id) -> [cpu_time, time of the first submission that counted]
+        self.performances = {}
+        # (user_id, assignment_id) that have benchmarks at all, even if none of them counted
+        self.benchmarked = set()
+        # (user_id, week_number, language) -> (cpu_time, metric_id)
+        self.leaderboard = {}
+        # (week_number, language) -> fastest time so far
+        self.leading_times = {}
+        # user_id -> names of the awards earned with a single submission
+        self.submission_awards = {}
+        # user_id -> final performances, filled in by plan_performances
+        self.user_performances = {}
+        self.metric_count = 0
+
+    def run(self):
+        """
+        A push takes first place if it is at least as fast as the fastest time so far, like in ingest_submission
+        """
+        metrics = BenchmarkMetric.objects.filter(user__isnull=False).order_by(
+            'benchmark_result__submission_time', 'benchmark_result_id', 'id'
+        ).values_list(
+            'id', 'benchmark_result_id', 'user_id', 'assignment_id', 'week_number', 'language', 'cpu_time',
+            'benchmark_result__submission_time'
+        )
+
+        current_result = None
+        for (metric_id, result_id, user_id, assignment_id, week_number, language, cpu_time,
+             submission_time) in metrics.iterator(chunk_size=self.chunk_size):
+            self.metric_count += 1
+
+            # time based awards count every push, even for assignments that are over
+            if self.awards and result_id != current_result:
+                current_result = result_id
+                earned = self.submission_awards.setdefault(user_id, set())
+                earned |= replay_awards(submission_time=submission_time)
+
+            key = (user_id, assignment_id)
+            self.benchmarked.add(key)
+            if assignment_has_ended(self.assignments[assignment_id], at=submission_time):
+                continue
+
+            best = self.performances.get(key)
+            if best is None:
+                self.performances[key] = [cpu_time, submission_time]
+            elif cpu_time < best[0]:
+                best[0] = cpu_time
+
+            if week_number is not None:
+                key = (user_id, week_number, language)
+                if key not in self.leaderboard or cpu_time < self.leaderboard[key][0]:
+                    self.leaderboard[key] = (cpu_time, metric_id)
+
+                leading_time = self.leading_times.get((week_number, language))
+                if leading_time is None or cpu_time <= leading_time:
+                    self.leading_times[(week_number, language)] = cpu_time
+                    if self.awards:
+                        self.submission_awards[user_id] |= replay_awards(leader_weeks=[week_number])
+
+        return self
+
+    def plan_performances(self):
+        """
+        Compares the replayed performances with the stored ones. Nothing is written yet, but afterwards
+        user_performances has the final performances of every user, for the totals and the awards.
+        Performances without any benchmarks (e.g. added in the admin panel) are kept
+        """
+        existing = {
+            (performance.user_id, performance.assignment_id): performance
+            for performance in Performance.objects.all()
+        }
+
+        created = []
+        updated = []
+        for (user_id, assignment_id), (cpu_time, submission_time) in self.performances.items():
+            performance = existing.get((user_id, assignment_id))
+            if performance is None:
+                performance = Performance(
+                    user_id=user_id,
+                    assignment_id=assignment_id,
+                    score=int(cpu_time),
+                    submission_time=submission_time,
+                    completion_time=0,
+                    cpu_time=cpu_time
+                )
+                existing[(user_id, assignment_id)] = performance
+                created.append(performance)
+            # on a push, the performance is created a moment after the submission is stored
+            elif (performance.cpu_time != cpu_time or performance.score != int(cpu_time)
+                  or abs(performance.submission_time - submission_time) > timedelta(seconds=1)):
+                performance.score = int(cpu_time)
+                performance.cpu_time = cpu_time
+                performance.submission_time = submission_time
+                updated.append(performance)
+
+        # performances of benchmarks that don't count anymore, e.g. because the end date was moved
+        deleted = [existing.pop(key) for key in self.benchmarked if key in existing and key not in self.performances]
+
+        self.user_performances = {}
+        for performance in existing.values():
+            performance.assignment = self.assignments[performance.assignment_id]
+            self.user_performances.setdefault(performance.user_id, []).append(performance)
+
+        return created, updated, deleted
+
+    def write_performances(self, created, updated, deleted):
+        Performance.objects.bulk_create(created, batch_size=500)
+        Performance.objects.bulk_update(updated, ['score', 'cpu_time', 'submission_time'], batch_size=500)
+        Performance.objects.filter(pk__in=[performance.pk for performance in deleted]).delete()
+
+    def write_user_totals(self):
+        """
+        Fixes the totals of users that drifted from their performances. Returns the number of fixed users
+        """
+        drifted = []
+        for user in User.objects.only('id', 'total_score', 'assignments_completed'):
+            performances = self.user_performances.get(user.id, [])
+            total_score = sum(int(performance.score) for performance in performances)
+            if user.total_score != total_score or user.assignments_completed != len(performances):
+                user.total_score = total_score
+                user.assignments_completed = len(performances)
+                drifted.append(user)
+
+        User.objects.bulk_update(drifted, ['total_score', 'assignments_completed'], batch_size=500)
+        return len(drifted)
+
+    def write_leaderboard(self):
+        return write_leaderboard(self.leaderboard)
+
+
+def rebuild_leaderboard():
+    """
+    Rebuild all leaderboard entries from the stored metrics.
+    Only needed for data that was submitted before the leaderboard existed, or after manual changes in the db
+    """
+    return BenchmarkReplay().run().write_leaderboard()
+
@@ -51,6 +51,17 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Rankings and awards after a submission are processed by `manage.py run_miga_worker`.
+# Set MIGA_RUN_JOBS_INLINE=True to process them during the request instead (e.g. for local development)
+MIGA_RUN_JOBS_INLINE = os.getenv('MIGA_RUN_JOBS_INLINE', 'False') == 'True'
+
+# Push new results to open scoreboards with Server-Sent Events.
+# Only enable this when running the ASGI app (e.g. `uvicorn miga.asgi:application`), not with runserver/WSGI
+MIGA_LIVE_SCOREBOARD = os.getenv('MIGA_LIVE_SCOREBOARD', 'False') == 'True'
+
+# Number of requests per page kept for the request statistics at /stats/requests/ (per process)
+MIGA_REQUEST_STATS_WINDOW = int(os.getenv('MIGA_REQUEST_STATS_WINDOW', '500'))
+
 # Authentication settings
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
@@ -63,6 +74,8 @@ STATICFILES_DIRS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the time of all other middleware is measured as well
+    'miga.instrumentation.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,6 +113,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # wait up to 20s for the write lock instead of failing with "database is locked" right away
+            'timeout': 20,
+            # take the write lock when a transaction starts. Upgrading a read lock later fails without waiting
+            'transaction_mode': 'IMMEDIATE',
+            # WAL: readers don't block the writer and the writer doesn't block readers.
+            # synchronous=NORMAL is safe with WAL and only syncs at checkpoints. 20 MB page cache per connection
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA temp_store=MEMORY'
+            ),
+        },
+    }
+}
+
+# How often a write is retried (with backoff) if the db is still locked after the timeout
+MIGA_DB_LOCK_RETRIES = int(os.getenv('MIGA_DB_LOCK_RETRIES', '5'))
+# Run all submission writes of a process on a single thread, one after another (see db.py)
+MIGA_SINGLE_WRITER = os.getenv('MIGA_SINGLE_WRITER', 'False') == 'True'
+
+# Cache for the dashboard and scoreboard. File based, so it is shared by all worker processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('MIGA_CACHE_DIR', BASE_DIR / 'cache'),
     }
 }
 
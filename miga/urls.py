@@ -32,6 +32,15 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('profile/', views.profile, name='profile'),
     path('scoreboard/', views.scoreboard, name='scoreboard'),
+    path('scoreboard/stream/', views.scoreboard_stream, name='scoreboard_stream'),
+    path('stats/cache/', views.cache_stats, name='cache_stats'),
+    path('stats/requests/', views.request_stats_page, name='request_stats'),
 
     path('api/benchmark-results/', views.submit_benchmark, name='submit_benchmark'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+
+    # JSON endpoints used by the dashboard and scoreboard
+    path('api/rankings/<int:week_number>/', views.api_week_rankings, name='api_week_rankings'),
+    path('api/rank-history/', views.api_rank_history, name='api_rank_history'),
+    path('api/awards/', views.api_awards, name='api_awards'),
 ]
@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
@@ -7,93 +12,48 @@ from rest_framework.decorators import api_view, authentication_classes, permissi
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from .models import BenchmarkResult, BenchmarkMetric, Award, UserAward
-from .awards import check_awards, initialize_awards
-import re
+from .models import BenchmarkResult, Job
+from .db import is_lock_error, run_write
+from .ingest import ingest_submission
+from .jobs import enqueue
+from .broadcast import broadcaster
+from .cache import bump_leaderboard_version, get_cache_stats, get_cached, get_leaderboard_version
+from .instrumentation import request_stats
+from .dashboard import load_dashboard
+from .ranking import WEEK_NUMBERS, decode_cursor, get_scoreboard, get_scoreboard_around, get_user_week_rank
+import asyncio
 import json
-from math import ceil
-from django.db.models import Q
+from django.db import transaction
 
 
 User = get_user_model()
 
 
 # Helper funs
-def get_benchmark_pattern(week_number):
-    # my benchmarks are currenly all called BM_W<number>
-    # they used to be called BM_W<number>_<description>. both patterns now supported
-    return (
-        f"BM_W{week_number}_",
-        f"BM_W{week_number}"
-    )
-
-
-def get_benchmark_metrics(user=None, week_number=None, language='cpp'):
-    pattern_with_underscore, pattern_without_underscore = get_benchmark_pattern(week_number)
-
-    query = Q(benchmark_result__language=language)
-
-    if user:
-        query &= Q(benchmark_result__user=user)
-
-    if week_number:
-        query &= (
-            Q(benchmark_name__startswith=pattern_with_underscore) | 
-            Q(benchmark_name=pattern_without_underscore)
-        )
-
-    return BenchmarkMetric.objects.filter(query).order_by('-benchmark_result__submission_time')
-
-
-def get_user_rankings(week_number, language='cpp'):
+def get_dashboard_data(user):
     """
-    Calculate user rankings for a specific week and language.
+    Dashboard data of the user for all languages (see dashboard.py), cached until the leaderboard changes (see cache.py).
+    Also used by the JSON endpoints, so switching the language doesn't load anything again
     """
-    pattern_with_underscore, pattern_without_underscore = get_benchmark_pattern(week_number)
-
-    users_with_benchmarks = User.objects.filter(
-        (Q(benchmarkresult__metrics__benchmark_name__startswith=pattern_with_underscore) |
-        Q(benchmarkresult__metrics__benchmark_name=pattern_without_underscore)) &
-        Q(benchmarkresult__language=language)
-    ).distinct()
-
-    # Get best time for each user
-    user_times = {}
-    for user in users_with_benchmarks:
-        metrics = get_benchmark_metrics(user=user, week_number=week_number, language=language)
-        if metrics.exists():
-            user_times[user.id] = metrics.first().cpu_time
-
-    # Sort users by their benchmark times
-    sorted_users = sorted(
-        users_with_benchmarks,
-        key=lambda u: user_times.get(u.id, float('inf'))
-    )
-
-    return sorted_users, user_times
+    return get_cached('dashboard', lambda: load_dashboard(user), user=user)
 
 
-def calculate_user_rank(user, sorted_users):
-    """ Calculate a user's rank in a list of sorted users.] """
-    return next(
-        (i + 1 for i, u in enumerate(sorted_users) if u == user),
-        None
-    )
-
-
-def calculate_total_score(user, language='cpp'):
-    """Calculate total score for a user based on their best benchmark times."""
-    total_score = 0
-    for week in range(1, 7):
-        best_metric = get_benchmark_metrics(user=user, week_number=week, language=language).order_by('cpu_time').first()
-
-        if best_metric:
-            # nanoseconds -> milliseconds,  calculate score
-            cpu_time_ms = best_metric.cpu_time / 1_000_000
-            week_score = 1000 - (cpu_time_ms * 100)
-            total_score += ceil(max(0.0, week_score))  # Ensure score doesn't go negative
-
-    return total_score
+def build_performance_data(user, language):
+    """
+    Everything shown on the dashboard for one language
+    """
+    dashboard_data = get_dashboard_data(user)
+    rank_history = dashboard_data['languages'][language]
+
+    return {
+        'total_score': rank_history['total_score'],
+        # JSON used for safe use in template
+        'ranking_history': json.dumps(rank_history['ranking_history']),
+        'week_labels': json.dumps(rank_history['week_labels']),
+        'best_rank': rank_history['best_rank'],
+        'total_rank': rank_history['total_rank'],
+        'awards': dashboard_data['awards'],
+    }
 
 
 def redirect_to_dashboard(request):
@@ -107,79 +67,14 @@ def dashboard(request):
 
     #  use the language of the user's most recent benchmark
     if not language:
-        latest_benchmark = BenchmarkResult.objects.filter(user=request.user).order_by('-submission_time').first()
-        language = latest_benchmark.language if latest_benchmark else 'cpp'
+        latest_language = BenchmarkResult.objects.filter(user=request.user).order_by(
+            '-submission_time').values_list('language', flat=True).first()
+        language = latest_language or 'cpp'
 
     if language not in ['cpp', 'rust']:
         language = 'cpp'
 
-    ranking_history = []
-    week_labels = []
-
-    for week in range(1, 7):
-        week_labels.append(f"Week {week}")
-
-        sorted_users, user_times = get_user_rankings(week, language)
-
-        ranked_users = [(user.id, user_times.get(user.id, float('inf'))) for user in sorted_users]
-        ranked_users.sort(key=lambda x: x[1])
-
-        current_user_rank = None
-        for i, (user_id, _) in enumerate(ranked_users, 1):
-            if user_id == request.user.id:
-                current_user_rank = i
-                break
-
-        ranking_history.append(current_user_rank)
-
-    week_labels_js = [str(label) for label in week_labels]
-
-    total_score = calculate_total_score(request.user, language)
-
-    # JSON used for safe use in template
-    ranking_history_json = json.dumps(ranking_history)
-    week_labels_json = json.dumps(week_labels_js)
-
-    # valc best rank
-    valid_ranks = [rank for rank in ranking_history if rank is not None]
-    best_rank = min(valid_ranks) if valid_ranks else None
-
-    # calc total rank based on total score for the selected language
-    all_users = User.objects.all()
-    user_scores = [(user, calculate_total_score(user, language)) for user in all_users]
-    sorted_users = sorted(user_scores, key=lambda x: x[1], reverse=True)
-    total_rank = next((i + 1 for i, (user, _) in enumerate(sorted_users) if user == request.user), None)
-
-    initialize_awards()
-
-    check_awards(
-        user=request.user,
-        ranks_history=ranking_history,
-        current_rank=total_rank
-    )
-
-    all_awards = Award.objects.all()
-    for award in all_awards:
-        print(f"Award: {award.name}, Image: {award.image_name}")
-        earned = UserAward.objects.filter(user=request.user, award=award).exists()
-        print(f"Earned: {earned}")
-
-    performance_data = {
-        'total_score': total_score,
-        'ranking_history': ranking_history_json,
-        'week_labels': week_labels_json,
-        'best_rank': best_rank,
-        'total_rank': total_rank,
-        'awards': [
-            {
-                'name': award.name,
-                'description': award.description,
-                'image_name': award.image_name,
-                'earned': UserAward.objects.filter(user=request.user, award=award).exists()
-            }
-            for award in Award.objects.all()
-        ]
-    }
+    performance_data = build_performance_data(request.user, language)
 
     return render(request, 'miga/dashboard.html', {
         'user': request.user,
@@ -193,12 +88,35 @@ def profile(request):
         use_hidden_username = request.POST.get('use_hidden_username') == 'on'
         request.user.use_hidden_username = use_hidden_username
         request.user.save()
+        # the scoreboard shows the name that was chosen here
+        bump_leaderboard_version()
 
     return render(request, 'miga/profile.html', {
         'user': request.user,
     })
 
 
+def get_scoreboard_page(request, week_number, language):
+    """
+    The page of the scoreboard asked for in the request: the top users, the page after the `after` cursor,
+    or the users around the current user with `around=me`.
+    Only the top page is the same for everyone, so only that one is cached
+    """
+    if request.GET.get('around') == 'me':
+        return get_scoreboard_around(request.user, week_number, language)
+
+    after = request.GET.get('after')
+    if after:
+        return get_scoreboard(week_number, language, after=after)
+
+    return get_cached(
+        'scoreboard',
+        lambda: get_scoreboard(week_number, language),
+        language=language,
+        week=week_number
+    )
+
+
 @login_required
 def scoreboard(request):
     period = request.GET.get('period', 'week1')
@@ -207,94 +125,220 @@ def scoreboard(request):
     if language not in ['cpp', 'rust']:
         language = 'cpp'
 
-    week_number = int(period.replace('week', ''))
-
-    sorted_users, user_times = get_user_rankings(week_number, language)
+    try:
+        week_number = int(period.replace('week', ''))
+    except ValueError:
+        week_number = 1
+    if week_number not in WEEK_NUMBERS:
+        week_number = 1
+        period = 'week1'
 
-    for user in sorted_users:
-        user.user_awards = UserAward.objects.filter(user=user).select_related('award')
-        # Add CPU time to user object for easy access in template
-        user.cpu_time = user_times.get(user.id, 0)
+    board = get_scoreboard_page(request, week_number, language)
 
-    current_user_rank = calculate_user_rank(request.user, sorted_users) or 0
+    current_user_rank = get_user_week_rank(request.user, week_number, language) or 0
 
     return render(request, 'miga/scoreboard.html', {
-        'users': sorted_users[:10],
+        'users': board['rows'],
+        'next_cursor': board['next_cursor'],
+        'around_me': request.GET.get('around') == 'me',
         'current_period': period,
         'current_language': language,
         'current_user_rank': current_user_rank,
+        'live_scoreboard': settings.MIGA_LIVE_SCOREBOARD,
+    })
+
+@login_required
+async def scoreboard_stream(request):
+    """
+    Server-Sent Events for the scoreboard: the current board first, then only what changed.
+    This needs the ASGI server (see asgi.py), all clients of a board share one computation (see broadcast.py)
+    """
+    language = get_language_param(request)
+    try:
+        week_number = int(request.GET.get('period', 'week1').replace('week', ''))
+    except ValueError:
+        week_number = 1
+
+    if week_number not in WEEK_NUMBERS:
+        return JsonResponse({"status": "error", "message": "Invalid week"}, status=404)
+
+    queue, board = await broadcaster.subscribe(week_number, language)
+
+    async def events():
+        try:
+            yield f"event: board\ndata: {json.dumps(board)}\n\n"
+            while True:
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing the connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: delta\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            broadcaster.unsubscribe(week_number, language, queue)
+
+    return StreamingHttpResponse(events(), content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     })
 
+
+@staff_member_required
+def cache_stats(request):
+    """
+    Cache hits and misses of the dashboard and scoreboard in this process, to check if the cache actually helps
+    """
+    return JsonResponse(get_cache_stats())
+
+
+@staff_member_required
+def request_stats_page(request):
+    """
+    Latency, queries and repeated queries of the last requests per page of this process (see instrumentation.py)
+    """
+    return render(request, 'miga/request_stats.html', {
+        'title': 'Request statistics',
+        'endpoints': request_stats.summary(),
+        'window': request_stats.window,
+        'cache_stats': get_cache_stats(),
+    })
+
+
+def get_language_param(request, default='cpp'):
+    language = request.GET.get('language', default)
+    return language if language in ['cpp', 'rust'] else 'cpp'
+
+
+# ETags only depend on the leaderboard version, so a 304 is answered without loading any data
+def week_rankings_etag(request, week_number):
+    # the cursor is parsed, so only valid values end up in the header
+    cursor = decode_cursor(request.GET.get('after'))
+    if request.GET.get('around') == 'me':
+        page = 'around'
+    elif cursor:
+        page = f"after-{cursor[0]!r}-{cursor[1]}"
+    else:
+        page = 'top'
+    return f"rankings-{week_number}-{get_language_param(request)}-{page}-{request.user.id}-{get_leaderboard_version()}"
+
+
+def rank_history_etag(request):
+    return f"rank-history-{get_language_param(request)}-{request.user.id}-{get_leaderboard_version()}"
+
+
+def awards_etag(request):
+    return f"awards-{request.user.id}-{get_leaderboard_version()}"
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=week_rankings_etag)
+def api_week_rankings(request, week_number):
+    """
+    The scoreboard of a week as JSON
+    """
+    if week_number not in WEEK_NUMBERS:
+        return JsonResponse({"status": "error", "message": "Invalid week"}, status=404)
+
+    language = get_language_param(request)
+    board = get_scoreboard_page(request, week_number, language)
+
+    return JsonResponse({
+        'week': week_number,
+        'language': language,
+        'rankings': board['rows'],
+        'next_cursor': board['next_cursor'],
+        'current_user_rank': get_user_week_rank(request.user, week_number, language),
+    })
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=rank_history_etag)
+def api_rank_history(request):
+    """
+    The user's rank per week, total score and overall rank as JSON
+    """
+    language = get_language_param(request)
+    return JsonResponse(get_dashboard_data(request.user)['languages'][language])
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=awards_etag)
+def api_awards(request):
+    """
+    All awards and whether the user earned them, as JSON
+    """
+    return JsonResponse({'awards': get_dashboard_data(request.user)['awards']})
+
+
+def store_submission(user, language, raw_data):
+    """
+    Stores the submission and queues its job in one transaction, so it can be retried as a whole if the db was locked
+    """
+    with transaction.atomic():
+        benchmark_result, submitted_week_numbers, leader_weeks, improved_weeks, completed_weeks = ingest_submission(
+            user, language, raw_data
+        )
+
+        # rankings and awards are done by the worker, so the CI job doesn't have to wait for them
+        return enqueue(
+            'process_submission',
+            user=user,
+            benchmark_result_id=benchmark_result.id,
+            week_numbers=submitted_week_numbers,
+            leader_weeks=leader_weeks,
+            improved_weeks=improved_weeks,
+            completed_weeks=completed_weeks
+        )
+
+
 @api_view(['POST'])
 @authentication_classes([TokenAuthentication])
 @permission_classes([IsAuthenticated])
 @csrf_exempt
 def submit_benchmark(request):
     try:
-        initialize_awards()
-
         language = request.data.get('language', 'cpp')
 
         if language not in ['cpp', 'rust']:
             return Response({"status": "error", "message": "Invalid language. Must be 'cpp' or 'rust'"},
                            status=status.HTTP_400_BAD_REQUEST)
 
-        benchmark_result = BenchmarkResult.objects.create(
-            user=request.user,
-            raw_data=request.data.get('raw_data', {}),
-            language=language
-        )
-        benchmarks = request.data.get('raw_data', {}).get('benchmarks', [])
-
-        submitted_week_numbers = []
-        for benchmark in benchmarks:
-            name = benchmark.get('name', '')
-            if name:
-                week_match = re.search(r'W(\d+)', name)
-                if week_match:
-                    week_number = int(week_match.group(1))
-                    submitted_week_numbers.append(week_number)
-                    assignment_name = f"Week {week_number}"
-
-                    from .models import Assignment
-                    assignment, _ = Assignment.objects.get_or_create(
-                        name=assignment_name,
-                        defaults={'description': f'Assignment for Week {week_number}'}
-                    )
-
-                    BenchmarkMetric.objects.create(
-                        benchmark_result=benchmark_result,
-                        benchmark_name=name,
-                        assignment=assignment,
-                        cpu_time=benchmark.get('cpu_time', 0),
-                        real_time=benchmark.get('real_time', 0),
-                        iterations=benchmark.get('iterations', 0)
-                    )
-
-        current_week = max(submitted_week_numbers) if submitted_week_numbers else 1
-
-        sorted_users, _ = get_user_rankings(current_week, language)
-
-        current_rank = calculate_user_rank(request.user, sorted_users) or 0
-
-        ranks_history = []
-        for week in range(1, 7):
-            week_sorted_users, _ = get_user_rankings(week, language)
-
-            rank = calculate_user_rank(request.user, week_sorted_users)
-            if rank:
-                ranks_history.append(rank)
-
-        check_awards(
-            user=request.user,
-            submission_time=benchmark_result.submission_time,
-            ranks_history=ranks_history,
-            current_rank=current_rank
-        )
+        job = run_write(store_submission, request.user, language, request.data.get('raw_data', {}))
 
-        return Response({"status": "success", "message": "Benchmark results recorded"},
-                        status=status.HTTP_201_CREATED)
+        return Response({"status": "success", "message": "Benchmark results recorded", "job_id": job.id},
+                        status=status.HTTP_202_ACCEPTED)
 
     except Exception as e:
+        if is_lock_error(e):
+            # the db was still locked after retrying, the CI job should try again later instead of losing the submission
+            return Response({"status": "error", "message": "The server is busy, please try again"},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
         return Response({"status": "error", "message": str(e)},
                         status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([IsAuthenticated])
+def job_status(request, job_id):
+    """
+    Lets the CI poll the job that was created for a submission
+    """
+    job = Job.objects.filter(pk=job_id, user=request.user).first()
+
+    if job is None:
+        return Response({"status": "error", "message": "Job not found"},
+                        status=status.HTTP_404_NOT_FOUND)
+
+    return Response({
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "error": job.error if job.status == Job.FAILED else None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    })